@@ -0,0 +1,314 @@
+import json
+import os
+from hashlib import sha256
+from tempfile import mkstemp
+from time import time
+from urllib2 import HTTPError, Request, URLError, urlopen
+from charmhelpers.core.host import log
+
+
+chunk_size = 64 * 1024
+
+# The response headers which identify a version of a remote file
+validator_headers = ['ETag', 'Last-Modified', 'Content-Length']
+
+
+class ArtifactCache(object):
+    """
+    A local content-addressed store of downloaded files.
+
+    Files are stored by their sha256 digest under `cache_dir`/blobs,
+    and an index maps each URL to the digest of its last download,
+    along with the HTTP validators (ETag, Last-Modified)
+    needed to ask the server whether it has changed.
+
+    Once the store grows beyond `max_bytes`,
+    the least recently used files are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.blobs_dir = os.path.join(cache_dir, 'blobs')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(self.blobs_dir):
+            os.makedirs(self.blobs_dir)
+
+        self.index = self._load_index()
+
+    def _load_index(self):
+        index = {'urls': {}, 'blobs': {}}
+
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as index_file:
+                    index.update(json.load(index_file))
+            except ValueError:
+                log('Artifact cache index is corrupt, starting afresh')
+
+        return index
+
+    def _save_index(self):
+        (handle, temp_path) = mkstemp(dir=self.cache_dir)
+
+        with os.fdopen(handle, 'w') as index_file:
+            json.dump(self.index, index_file)
+
+        os.rename(temp_path, self.index_path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest)
+
+    def _has_blob(self, digest):
+        return bool(digest) and os.path.isfile(self.blob_path(digest))
+
+    def _touch(self, digest):
+        self.index['blobs'][digest]['last_used'] = time()
+        self._save_index()
+
+    def open(self, url, expected_sha256=None):
+        """
+        Return a file-like object for the contents of `url`.
+
+        If `expected_sha256` is already in the cache, or the server says
+        our cached copy is still current, read from the cache.
+        Otherwise return a reader that saves the download into the cache
+        as it is read, and checks it against `expected_sha256`.
+        """
+
+        if self._has_blob(expected_sha256):
+            log('Artifact cache hit by digest for {0}'.format(url))
+            self._touch(expected_sha256)
+
+            return open(self.blob_path(expected_sha256), 'rb')
+
+        entry = self.index['urls'].get(url, {})
+        request = Request(url)
+
+        if not expected_sha256 and self._has_blob(entry.get('sha256')):
+            if entry.get('etag'):
+                request.add_header('If-None-Match', entry['etag'])
+            if entry.get('last_modified'):
+                request.add_header('If-Modified-Since', entry['last_modified'])
+
+        try:
+            response = urlopen(request)
+        except HTTPError as error:
+            if error.code != 304:
+                raise
+
+            log('Artifact cache hit (not modified) for {0}'.format(url))
+            self._touch(entry['sha256'])
+
+            return open(self.blob_path(entry['sha256']), 'rb')
+
+        log('Artifact cache miss for {0}'.format(url))
+
+        return CachingReader(self, url, response, expected_sha256)
+
+    def fetch(self, url, expected_sha256=None):
+        """
+        Make sure the contents of `url` are in the cache,
+        and return the path to the cached file
+        """
+
+        reader = self.open(url, expected_sha256)
+
+        if isinstance(reader, CachingReader):
+            try:
+                digest = reader.save()
+            except Exception:
+                reader.discard()
+                raise
+        else:
+            reader.close()
+            digest = os.path.basename(reader.name)
+
+        return self.blob_path(digest)
+
+    def add(self, url, temp_path, digest, headers):
+        """
+        Move a completed download into the store and record it
+        """
+
+        os.rename(temp_path, self.blob_path(digest))
+
+        self.index['blobs'][digest] = {
+            'size': os.path.getsize(self.blob_path(digest)),
+            'last_used': time()
+        }
+        self.index['urls'][url] = {
+            'sha256': digest,
+            'etag': headers.getheader('ETag'),
+            'last_modified': headers.getheader('Last-Modified')
+        }
+
+        self.evict(keep=digest)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used files until the cache fits in max_bytes
+        """
+
+        blobs = self.index['blobs']
+        total = sum(blob['size'] for blob in blobs.values())
+
+        by_age = sorted(blobs.items(), key=lambda item: item[1]['last_used'])
+
+        for (digest, blob) in by_age:
+            if total <= self.max_bytes:
+                break
+
+            if digest == keep:
+                continue
+
+            log('Evicting {0} from artifact cache'.format(digest))
+
+            if os.path.isfile(self.blob_path(digest)):
+                os.remove(self.blob_path(digest))
+
+            total -= blob['size']
+            del blobs[digest]
+
+        # Forget URLs whose files are gone
+        for (url, entry) in self.index['urls'].items():
+            if entry['sha256'] not in blobs:
+                del self.index['urls'][url]
+
+        self._save_index()
+
+
+class CachingReader(object):
+    """
+    Read an HTTP response, copying it into the cache as it goes.
+    The file is only added to the cache once it has been read to the end
+    and its digest is verified.
+    """
+
+    def __init__(self, cache, url, response, expected_sha256=None):
+        self.cache = cache
+        self.url = url
+        self.response = response
+        self.expected_sha256 = expected_sha256
+        self.hash = sha256()
+        self.bytes_read = 0
+        self.digest = None
+
+        (handle, self.temp_path) = mkstemp(dir=cache.blobs_dir)
+        self.temp_file = os.fdopen(handle, 'wb')
+
+    def read(self, size=-1):
+        data = self.response.read(size)
+
+        self.hash.update(data)
+        self.temp_file.write(data)
+        self.bytes_read += len(data)
+
+        return data
+
+    def save(self):
+        """
+        Read whatever is left of the response, then add it to the cache.
+        A response which ends before its Content-Length is discarded,
+        so a truncated download is never cached under the server's
+        validators, to be reused on every later "not modified".
+        Return its digest.
+        """
+
+        if self.digest:
+            return self.digest
+
+        try:
+            while self.read(chunk_size):
+                pass
+
+            self.temp_file.close()
+            self.response.close()
+
+            expected_length = self.response.info().getheader('Content-Length')
+
+            if expected_length and int(expected_length) != self.bytes_read:
+                raise IOError(
+                    "Download of {url} ended after {actual} of "
+                    "{expected} bytes".format(
+                        url=self.url,
+                        actual=self.bytes_read,
+                        expected=expected_length
+                    )
+                )
+
+            digest = self.hash.hexdigest()
+
+            if self.expected_sha256 and digest != self.expected_sha256:
+                raise ValueError(
+                    "sha256 of {url} is {actual}, expected {expected}".format(
+                        url=self.url,
+                        actual=digest,
+                        expected=self.expected_sha256
+                    )
+                )
+
+            self.cache.add(
+                self.url, self.temp_path, digest, self.response.info()
+            )
+        finally:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+        self.digest = digest
+
+        return digest
+
+    def close(self):
+        self.save()
+
+    def discard(self):
+        """
+        Abandon the download without reading the rest of it
+        or adding it to the cache
+        """
+
+        self.temp_file.close()
+        self.response.close()
+
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def file_sha256(file_path):
+    digest = sha256()
+
+    with open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), ''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def remote_fingerprint(url):
+    """
+    Ask the server what it would send for `url`, without downloading it:
+    the ETag, Last-Modified and Content-Length headers it gives.
+    Return None if the request fails or the server gives none of them,
+    as then there's no telling whether the file has changed
+    """
+
+    request = Request(url)
+    request.get_method = lambda: 'HEAD'
+
+    try:
+        response = urlopen(request, timeout=30)
+    except (URLError, IOError) as error:
+        log('Failed to check {0} for changes: {1}'.format(url, error))
+        return None
+
+    headers = response.info()
+    response.close()
+
+    fingerprint = dict(
+        (name, headers.getheader(name)) for name in validator_headers
+        if headers.getheader(name)
+    )
+
+    return fingerprint or None
@@ -5,6 +5,7 @@
 #  Matthew Wedgwood <matthew.wedgwood@canonical.com>
 
 import subprocess
+import pipes
 import pwd
 import grp
 import os
@@ -116,7 +117,7 @@ define service {{
             raise CheckException("shortname must match {}".format(
                 Check.shortname_re))
         self.shortname = shortname
-        self.command = "check_{}".format(shortname)
+        self.command = Check.command_name(shortname)
         # Note: a set of invalid characters is defined by the
         # Nagios server config
         # The default is: illegal_object_name_chars=`~!$%^&*"|'<>?,()=
@@ -133,14 +134,22 @@ define service {{
             if os.path.exists(os.path.join(path, parts[0])):
                 command = os.path.join(path, parts[0])
                 if len(parts) > 1:
-                    command += " " + " ".join(parts[1:])
+                    command += " " + " ".join(
+                        pipes.quote(part) for part in parts[1:])
                 return command
         log('Check command not found: {}'.format(parts[0]))
         return ''
 
+    @staticmethod
+    def command_name(shortname):
+        return "check_{}".format(shortname)
+
+    @staticmethod
+    def nrpe_check_file(command):
+        return os.path.join(NRPE.nrpe_confdir, '{}.cfg'.format(command))
+
     def write(self, nagios_context, hostname):
-        nrpe_check_file = '/etc/nagios/nrpe.d/{}.cfg'.format(
-            self.command)
+        nrpe_check_file = Check.nrpe_check_file(self.command)
         with open(nrpe_check_file, 'w') as nrpe_check_config:
             nrpe_check_config.write("# check {}\n".format(self.shortname))
             nrpe_check_config.write("command[{}]={}\n".format(
@@ -152,11 +161,37 @@ define service {{
         else:
             self.write_service_config(nagios_context, hostname)
 
-    def write_service_config(self, nagios_context, hostname):
+    def remove(self, hostname):
+        Check.remove_files(self.shortname)
+
+    @classmethod
+    def remove_files(cls, shortname):
+        """Remove the NRPE command and exported service config
+        written for a check, given just its shortname"""
+        if not re.match(cls.shortname_re, shortname):
+            raise CheckException("shortname must match {}".format(
+                cls.shortname_re))
+        command = cls.command_name(shortname)
+
+        nrpe_check_file = cls.nrpe_check_file(command)
+        if os.path.exists(nrpe_check_file):
+            os.remove(nrpe_check_file)
+
+        if os.path.exists(NRPE.nagios_exportdir):
+            cls._remove_service_files_for(command)
+
+    def _remove_service_files(self):
+        Check._remove_service_files_for(self.command)
+
+    @staticmethod
+    def _remove_service_files_for(command):
         for f in os.listdir(NRPE.nagios_exportdir):
-            if re.search('.*{}.cfg'.format(self.command), f):
+            if re.search('.*{}.cfg'.format(command), f):
                 os.remove(os.path.join(NRPE.nagios_exportdir, f))
 
+    def write_service_config(self, nagios_context, hostname):
+        self._remove_service_files()
+
         templ_vars = {
             'nagios_hostname': hostname,
             'nagios_servicegroup': nagios_context,
@@ -179,10 +214,10 @@ class NRPE(object):
     nagios_exportdir = '/var/lib/nagios/export'
     nrpe_confdir = '/etc/nagios/nrpe.d'
 
-    def __init__(self):
+    def __init__(self, nagios_context=None):
         super(NRPE, self).__init__()
         self.config = config()
-        self.nagios_context = self.config['nagios_context']
+        self.nagios_context = nagios_context or self.config['nagios_context']
         self.unit_name = local_unit().replace('/', '-')
         self.hostname = "{}-{}".format(self.nagios_context, self.unit_name)
         self.checks = []
@@ -190,6 +225,11 @@ class NRPE(object):
     def add_check(self, *args, **kwargs):
         self.checks.append(Check(*args, **kwargs))
 
+    def remove_check(self, shortname):
+        """Remove a check's NRPE command and exported service config,
+        if an earlier hook wrote them"""
+        Check.remove_files(shortname)
+
     def write(self):
         try:
             nagios_uid = pwd.getpwnam('nagios').pw_uid
@@ -4,8 +4,10 @@
 # Authors:
 #  Charm Helpers Developers <juju@lists.ubuntu.com>
 
+import atexit
 import os
 import json
+import time
 import yaml
 import subprocess
 import sys
@@ -58,13 +60,67 @@ def flush(key):
         del cache[item]
 
 
+# Messages wait in a buffer and are sent to juju-log in batches,
+# rather than forking juju-log for every line.
+# The buffer is flushed when it grows past LOG_BUFFER_SIZE characters,
+# when a message at one of LOG_FLUSH_LEVELS arrives, and when the hook exits
+LOG_BUFFER_SIZE = 32768
+LOG_FLUSH_LEVELS = (CRITICAL, ERROR, WARNING)
+
+_log_buffer = []
+_log_file_path = None
+
+
 def log(message, level=None):
     """Write a message to the juju log"""
-    command = ['juju-log']
-    if level:
-        command += ['-l', level]
-    command += [message]
-    subprocess.call(command)
+    _log_buffer.append((level, message))
+
+    if _log_file_path:
+        _write_log_record(level, message)
+
+    if (level in LOG_FLUSH_LEVELS or
+            sum(len(item[1]) for item in _log_buffer) >= LOG_BUFFER_SIZE):
+        flush_log()
+
+
+def flush_log():
+    """Send buffered messages to juju-log, one call per run of
+    messages at the same level"""
+    while _log_buffer:
+        level = _log_buffer[0][0]
+        lines = []
+        while _log_buffer and _log_buffer[0][0] == level:
+            lines.append(_log_buffer.pop(0)[1])
+        command = ['juju-log']
+        if level:
+            command += ['-l', level]
+        command += ['\n'.join(lines)]
+        subprocess.call(command)
+
+
+def log_to_file(path):
+    """Also append every message to `path`, one JSON record per line,
+    or stop doing so if `path` is empty"""
+    global _log_file_path
+    _log_file_path = path or None
+
+
+def _write_log_record(level, message):
+    record = {
+        'time': time.time(),
+        'hook': hook_name(),
+        'unit': os.environ.get('JUJU_UNIT_NAME'),
+        'level': level or INFO,
+        'message': message,
+    }
+    try:
+        with open(_log_file_path, 'a') as log_file:
+            log_file.write(json.dumps(record) + '\n')
+    except IOError:
+        pass
+
+
+atexit.register(flush_log)
 
 
 class Serializable(UserDict.IterableUserDict):
@@ -155,19 +211,91 @@ def hook_name():
     return os.path.basename(sys.argv[0])
 
 
+class Config(dict):
+    """A Juju charm config dictionary that remembers the previous config
+
+    The config can be saved to disk at the end of a hook with save(),
+    and the next hook can then see what has changed. For example:
+
+        config = hookenv.config()
+        if config.changed('port'):
+            close_port(config.previous('port'))
+            open_port(config['port'])
+        config.save()
+
+    The snapshot is kept in $CHARM_DIR/.juju-persistent-config
+    """
+    CONFIG_FILE_NAME = '.juju-persistent-config'
+
+    def __init__(self, *args, **kwargs):
+        super(Config, self).__init__(*args, **kwargs)
+        self._prev_dict = None
+        self.path = os.path.join(charm_dir() or '', Config.CONFIG_FILE_NAME)
+        if os.path.exists(self.path):
+            self.load_previous()
+
+    def load_previous(self, path=None):
+        """Load the previous config from `path` (or the default snapshot)"""
+        self.path = path or self.path
+        try:
+            with open(self.path) as f:
+                self._prev_dict = json.load(f)
+        except ValueError:
+            log('Ignoring unreadable config snapshot {}'.format(self.path),
+                level=WARNING)
+
+    def has_previous(self):
+        """Whether there is a previous config to compare against"""
+        return self._prev_dict is not None
+
+    def changed(self, key):
+        """Whether `key` differs from the previous config
+        (always True if there is no previous config)"""
+        if self._prev_dict is None:
+            return True
+        return self.previous(key) != self.get(key)
+
+    def changed_keys(self):
+        """All keys whose values differ from the previous config"""
+        previous_keys = set(self._prev_dict or {})
+        return set(key for key in set(self) | previous_keys
+                   if self.changed(key))
+
+    def previous(self, key):
+        """The value of `key` in the previous config, or None"""
+        if self._prev_dict:
+            return self._prev_dict.get(key)
+        return None
+
+    def save(self):
+        """Save this config as the previous config for future hooks"""
+        with open(self.path, 'w') as f:
+            json.dump(self, f)
+        self._prev_dict = dict(self)
+
+
 @cached
-def config(scope=None):
-    """Juju charm configuration"""
-    config_cmd_line = ['config-get']
-    if scope is not None:
-        config_cmd_line.append(scope)
-    config_cmd_line.append('--format=json')
+def _config_all():
+    """Fetch every config value with a single config-get call"""
     try:
-        return json.loads(subprocess.check_output(config_cmd_line))
+        return Config(json.loads(subprocess.check_output(
+            ['config-get', '--format=json'])))
     except ValueError:
         return None
 
 
+def config(scope=None):
+    """Juju charm configuration
+
+    All values are fetched once per hook, and keyed lookups
+    are served from that, rather than calling config-get for each key
+    """
+    settings = _config_all()
+    if scope is None or settings is None:
+        return settings
+    return settings.get(scope)
+
+
 @cached
 def relation_get(attribute=None, unit=None, rid=None):
     """Get relation information"""
@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+from hashlib import sha256
+
+
+# Saved in each release once its dependencies are installed
+record_name = '.dependencies.json'
+
+
+def dependencies_digest(requirements_path, cache_path, *settings):
+    """
+    A digest of everything that decides what pip would install:
+    the requirements file, the local package directory's listing,
+    the python version and any other `settings` that affect it
+    """
+
+    digest = sha256()
+    digest.update(sys.version)
+    digest.update(repr(settings))
+
+    if os.path.isfile(requirements_path):
+        with open(requirements_path, 'rb') as requirements:
+            digest.update(requirements.read())
+
+    if os.path.isdir(cache_path):
+        for name in sorted(os.listdir(cache_path)):
+            stats = os.stat(os.path.join(cache_path, name))
+            digest.update('{0} {1} {2}\n'.format(
+                name, stats.st_size, int(stats.st_mtime)
+            ))
+
+    return digest.hexdigest()
+
+
+def load_record(release_path):
+    """
+    The dependencies digest recorded for a release,
+    and how long installing them took, or None
+    """
+
+    record_path = os.path.join(release_path, record_name)
+
+    if os.path.isfile(record_path):
+        with open(record_path) as record:
+            try:
+                return json.load(record)
+            except ValueError:
+                pass
+
+
+def save_record(release_path, digest, seconds):
+    with open(os.path.join(release_path, record_name), 'w') as record:
+        json.dump({'digest': digest, 'seconds': seconds}, record)
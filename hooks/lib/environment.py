@@ -0,0 +1,98 @@
+import json
+import os
+import shlex
+from charmhelpers.core.host import log
+
+
+def parse_variables(variables_string):
+    """
+    Parse a shell-style string of assignments, like `A=1 B="two words"`,
+    into a dict
+    """
+
+    variables = {}
+
+    for assignment in shlex.split(variables_string or ''):
+        if '=' in assignment:
+            (name, value) = assignment.split('=', 1)
+            variables[name] = value
+
+    return variables
+
+
+def load_store(store_path):
+    """
+    The stored environment: each variable by name,
+    and which variables each owner (like "config") set last time
+    """
+
+    if os.path.isfile(store_path):
+        with open(store_path) as store_file:
+            try:
+                return json.load(store_file)
+            except ValueError:
+                log('Ignoring corrupt environment store {0}'.format(
+                    store_path
+                ))
+
+    return {'variables': {}, 'owners': {}}
+
+
+def save_store(store_path, store, group):
+    """
+    Write the store where the WSGI processes' group can read it,
+    but nobody else, as it may hold credentials
+    """
+
+    store_dir = os.path.dirname(store_path)
+
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    temp_path = '{0}.tmp-{1}'.format(store_path, os.getpid())
+
+    with open(temp_path, 'w') as store_file:
+        json.dump(store, store_file, indent=2, sort_keys=True)
+
+    os.chmod(temp_path, 0640)
+
+    try:
+        os.chown(temp_path, 0, group)
+    except OSError:
+        pass
+
+    os.rename(temp_path, store_path)
+
+
+def set_variables(store_path, variables, owner=None, group=-1):
+    """
+    Set environment variables in the store, replacing any existing values.
+    If an `owner` is given, its variables which aren't in `variables` any
+    more are removed.
+    Return True if the environment changed
+    """
+
+    store = load_store(store_path)
+    stored = store['variables']
+    before = dict(stored)
+
+    if owner:
+        for name in store['owners'].get(owner, []):
+            if name not in variables:
+                log('Removing environment variable {0}'.format(name))
+                stored.pop(name, None)
+
+        store['owners'][owner] = sorted(variables)
+
+    for (name, value) in variables.items():
+        if stored.get(name) != value:
+            log('Setting environment variable {0}'.format(name))
+            stored[name] = value
+
+    if stored == before and os.path.isfile(store_path):
+        return False
+
+    save_store(store_path, store, group)
+
+    return stored != before
+
@@ -0,0 +1,190 @@
+import os
+import shutil
+from time import time
+from hook_timings import record
+
+
+def timed(function):
+    """
+    Record each call in the hook's timing report,
+    alongside the subprocesses it replaces
+    """
+
+    def wrapper(*args, **kwargs):
+        start = time()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(
+                'in-process file operations',
+                function.__name__,
+                time() - start
+            )
+
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+
+    return wrapper
+
+
+@timed
+def make_dirs(dir_path):
+    """
+    Like `mkdir -p`: create a directory and its parents,
+    if it doesn't exist already
+    """
+
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+
+
+@timed
+def remove_path(target_path):
+    """
+    Like `rm -rf`: remove a file, link or directory tree,
+    if it exists
+    """
+
+    if os.path.isdir(target_path) and not os.path.islink(target_path):
+        shutil.rmtree(target_path)
+    elif os.path.lexists(target_path):
+        os.remove(target_path)
+
+
+@timed
+def link_tree(source_dir, target_dir):
+    """
+    Like `cp -al`: recreate a directory tree, with the same ownership and
+    permissions, hardlinking every file rather than copying it
+    """
+
+    for (root, dirs, files) in os.walk(source_dir):
+        target_root = os.path.join(
+            target_dir, os.path.relpath(root, source_dir)
+        )
+        stats = os.stat(root)
+
+        os.makedirs(target_root)
+        os.chown(target_root, stats.st_uid, stats.st_gid)
+        shutil.copystat(root, target_root)
+
+        # os.walk lists symlinks to directories as directories
+        dir_links = [
+            name for name in dirs if os.path.islink(os.path.join(root, name))
+        ]
+
+        for name in files + dir_links:
+            source_path = os.path.join(root, name)
+            target_path = os.path.join(target_root, name)
+
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+            else:
+                os.link(source_path, target_path)
+
+
+def path_state(file_path):
+    """
+    What's at a path: a symlink's target, a file's contents and
+    ownership and permissions, a directory, or nothing (None)
+    """
+
+    if os.path.islink(file_path):
+        return {'link': os.readlink(file_path)}
+
+    if os.path.isdir(file_path):
+        return {'dir': True}
+
+    if os.path.isfile(file_path):
+        stats = os.stat(file_path)
+
+        with open(file_path, 'rb') as source:
+            return {
+                'content': source.read(),
+                'mode': stats.st_mode,
+                'uid': stats.st_uid,
+                'gid': stats.st_gid
+            }
+
+
+def put_back(file_path, state):
+    """
+    Return a path to a state recorded by path_state,
+    replacing whatever is there in a single rename.
+    Directories are left alone
+    """
+
+    if os.path.isdir(file_path) and not os.path.islink(file_path):
+        return
+
+    if state is None:
+        if os.path.lexists(file_path):
+            os.remove(file_path)
+
+        return
+
+    if 'dir' in state:
+        return
+
+    temp_path = '{0}.tmp-{1}'.format(file_path, os.getpid())
+
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+
+    if 'link' in state:
+        os.symlink(state['link'], temp_path)
+    else:
+        with open(temp_path, 'wb') as target:
+            target.write(state['content'])
+
+        os.chown(temp_path, state['uid'], state['gid'])
+        os.chmod(temp_path, state['mode'])
+
+    os.rename(temp_path, file_path)
+
+
+@timed
+def snapshot_paths(file_paths, dir_paths=()):
+    """
+    Record what's at each of `file_paths`,
+    and what's in each of `dir_paths`, for restore_paths to put back
+    """
+
+    return {
+        'files': dict(
+            (file_path, path_state(file_path)) for file_path in file_paths
+        ),
+        'dirs': dict(
+            (
+                dir_path,
+                dict(
+                    (name, path_state(os.path.join(dir_path, name)))
+                    for name in os.listdir(dir_path)
+                ) if os.path.isdir(dir_path) else {}
+            )
+            for dir_path in dir_paths
+        )
+    }
+
+
+@timed
+def restore_paths(snapshot):
+    """
+    Put files and directory entries back as snapshot_paths found them,
+    removing any that weren't there
+    """
+
+    for (file_path, state) in snapshot['files'].items():
+        put_back(file_path, state)
+
+    for (dir_path, entries) in snapshot['dirs'].items():
+        if not os.path.isdir(dir_path):
+            continue
+
+        for name in os.listdir(dir_path):
+            if name not in entries:
+                put_back(os.path.join(dir_path, name), None)
+
+        for (name, state) in entries.items():
+            put_back(os.path.join(dir_path, name), state)
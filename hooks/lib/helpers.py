@@ -1,7 +1,11 @@
-import sh
-from os import path, pardir
+from os import getpid, path, pardir, remove, rename, symlink
+from threading import Thread
+from time import time
 from urllib2 import urlopen, URLError
 from charmhelpers.core.host import log
+from charmhelpers.fetch import apt_install, filter_installed_packages
+from fileops import make_dirs
+from hook_timings import record
 
 
 def create_dir(dir_path):
@@ -12,7 +16,25 @@ def create_dir(dir_path):
 
     if not path.exists(dir_path):
         log('Creating directory: {0}'.format(dir_path))
-        run(sh.mkdir, dir_path, p=True)
+        make_dirs(dir_path)
+
+
+def atomic_symlink(target, link_path):
+    """
+    Point a symlink at a new target in a single step,
+    by creating a temporary link beside it and renaming it into place,
+    so the link never goes missing
+    """
+
+    log('Linking {0} to {1}'.format(link_path, target))
+
+    temp_link_path = '{0}.tmp-{1}'.format(link_path, getpid())
+
+    if path.lexists(temp_link_path):
+        remove(temp_link_path)
+
+    symlink(target, temp_link_path)
+    rename(temp_link_path, link_path)
 
 
 def can_connect(url):
@@ -34,15 +56,51 @@ def can_connect(url):
     return success
 
 
-def install_packages(packages):
+def warm_up(urls, repeat=1, timeout=60):
+    """
+    Request each URL `repeat` times, all at once,
+    so that as much of the app's lazy start-up work as these requests
+    reach is done before real traffic arrives
+    Log the time and result of each request
     """
-    Install a list of packages if the list isn't empty
+
+    def request(url):
+        start = time()
+
+        try:
+            status = urlopen(url, timeout=timeout).getcode()
+        except Exception as error:
+            status = error
+
+        log("Warm-up request to {url}: {status} in {seconds:.2f}s".format(
+            url=url, status=status, seconds=time() - start
+        ))
+
+    threads = [
+        Thread(target=request, args=(url,))
+        for url in urls for attempt in range(repeat)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+
+def install_packages(*package_lists):
+    """
+    Install the packages from space-separated lists
+    which aren't already installed, in a single apt-get call,
     and log that we've done so
     """
 
-    if packages:
-        log("Installing apt packages: {0}".format(packages))
-        run(sh.apt_get.install, packages.split(), y=True)
+    packages = ' '.join(filter(None, package_lists)).split()
+    missing = filter_installed_packages(packages) if packages else []
+
+    if missing:
+        log("Installing apt packages: {0}".format(' '.join(missing)))
+        apt_install(missing, fatal=True)
 
 
 def parent_dir(dir_path):
@@ -54,10 +112,16 @@ def parent_dir(dir_path):
 
 def run(sh_function, *args, **kwargs):
     """
-    Run command with logging
+    Run command with logging,
+    and record it in the hook's timing report
     """
 
-    output = sh_function(*args, **kwargs)
+    start = time()
+
+    try:
+        output = sh_function(*args, **kwargs)
+    finally:
+        record('commands', path.basename(str(sh_function)), time() - start)
 
     if output:
         log(str(output))
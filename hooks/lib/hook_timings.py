@@ -0,0 +1,51 @@
+import atexit
+from time import time
+from charmhelpers.core.host import log
+
+
+# How often each kind of operation ran during this hook, and how long it took
+# {kind: {name: [count, seconds]}}
+timings = {}
+
+hook_start = time()
+
+
+def record(kind, name, seconds):
+    entry = timings.setdefault(kind, {}).setdefault(name, [0, 0.0])
+    entry[0] += 1
+    entry[1] += seconds
+
+
+def report():
+    """
+    Log how many commands the hook ran through helpers.run, and how many
+    in-process file operations it did, and how long each kind took.
+    Subprocesses started any other way (sh.py called directly,
+    charmhelpers' subprocess calls) aren't counted
+    """
+
+    if not timings:
+        return
+
+    lines = ['Hook finished in {0:.2f}s'.format(time() - hook_start)]
+
+    for (kind, names) in sorted(timings.items()):
+        count = sum(entry[0] for entry in names.values())
+        seconds = sum(entry[1] for entry in names.values())
+
+        lines.append('{count} {kind} in {seconds:.2f}s'.format(
+            count=count, kind=kind, seconds=seconds
+        ))
+
+        by_time = sorted(names.items(), key=lambda item: -item[1][1])
+
+        for (name, (name_count, name_seconds)) in by_time:
+            lines.append('    {name}: {count}x, {seconds:.2f}s'.format(
+                name=name, count=name_count, seconds=name_seconds
+            ))
+
+    log('\n'.join(lines))
+
+
+# Registered after hookenv's log flush, so it runs first
+atexit.register(report)
@@ -0,0 +1,220 @@
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from charmhelpers.core.host import log
+
+
+timestamp_format = '%Y-%m-%d-%H-%M-%S'
+timestamp_pattern = re.compile(r'^\d{4}(-\d{2}){5}$')
+
+
+def list_releases(install_parent):
+    """
+    Return the timestamps of the release directories in install_parent,
+    oldest first
+    """
+
+    return sorted(
+        name for name in os.listdir(install_parent)
+        if timestamp_pattern.match(name)
+        and os.path.isdir(os.path.join(install_parent, name))
+        and not os.path.islink(os.path.join(install_parent, name))
+    )
+
+
+def expired_releases(timestamps, keep, keep_days=0, protected=()):
+    """
+    Pick which releases to remove:
+    those that are neither among the newest `keep`,
+    nor younger than `keep_days` (if set), nor protected
+    """
+
+    newest = set(timestamps[-keep:]) if keep else set()
+    cutoff = None
+
+    if keep_days:
+        cutoff = datetime.now() - timedelta(days=keep_days)
+
+    expired = []
+
+    for timestamp in timestamps:
+        if timestamp in newest or timestamp in protected:
+            continue
+
+        created = datetime.strptime(timestamp, timestamp_format)
+
+        if cutoff and created > cutoff:
+            continue
+
+        expired.append(timestamp)
+
+    return expired
+
+
+def release_files(timestamp, sites_available_dir, certs_dir):
+    """
+    The files created alongside a release's directory
+    """
+
+    return [
+        os.path.join(sites_available_dir, timestamp),
+        os.path.join(certs_dir, 'wsgi-app.{0}.key'.format(timestamp)),
+        os.path.join(certs_dir, 'wsgi-app.{0}.crt'.format(timestamp))
+    ]
+
+
+def orphaned_timestamps(sites_available_dir, certs_dir, releases):
+    """
+    Timestamps of vhost and certificate files
+    which no longer have a release directory
+    """
+
+    names = os.listdir(sites_available_dir) if os.path.isdir(
+        sites_available_dir
+    ) else []
+
+    if os.path.isdir(certs_dir):
+        cert_pattern = re.compile(r'^wsgi-app\.(.+)\.(key|crt)$')
+
+        for name in os.listdir(certs_dir):
+            match = cert_pattern.match(name)
+
+            if match:
+                names.append(match.group(1))
+
+    return set(
+        name for name in names
+        if timestamp_pattern.match(name) and name not in releases
+    )
+
+
+def disk_usage(dir_path):
+    """
+    Bytes that removing dir_path would free.
+    Files hardlinked from outside the directory don't count.
+    """
+
+    links_seen = {}
+    inodes = {}
+
+    for (root, dirs, files) in os.walk(dir_path):
+        for name in dirs + files:
+            stats = os.lstat(os.path.join(root, name))
+            links_seen[stats.st_ino] = links_seen.get(stats.st_ino, 0) + 1
+            inodes[stats.st_ino] = stats
+
+    return sum(
+        stats.st_blocks * 512 for (inode, stats) in inodes.items()
+        if links_seen[inode] >= stats.st_nlink
+    )
+
+
+trash_prefix = '.deleting-'
+
+
+def remove_tree(dir_path):
+    """
+    Move a directory aside in one atomic rename,
+    so it never appears half-deleted, then delete it.
+    Each removal gets its own trash directory,
+    so one left behind by an interrupted removal never gets in the way
+    """
+
+    trash_path = tempfile.mkdtemp(
+        prefix=trash_prefix + os.path.basename(dir_path) + '-',
+        dir=os.path.dirname(dir_path)
+    )
+
+    os.rename(dir_path, os.path.join(trash_path, os.path.basename(dir_path)))
+    shutil.rmtree(trash_path)
+
+
+def remove_trash(install_parent):
+    """
+    Finish deleting any directories left behind by interrupted removals
+    """
+
+    for name in os.listdir(install_parent):
+        trash_path = os.path.join(install_parent, name)
+
+        if name.startswith(trash_prefix) and not os.path.islink(trash_path):
+            log('Removing leftover {0}'.format(trash_path))
+            shutil.rmtree(trash_path)
+
+
+def collect_garbage(
+    install_parent, live_link_path, sites_available_dir, certs_dir,
+    keep, keep_days=0, protected=()
+):
+    """
+    Remove expired releases along with their vhost and certificate files,
+    plus any vhosts and certificates left without a release.
+    The live release, and any in `protected`, are never removed.
+    Anything that can't be removed is logged and left for next time,
+    since the deploy it follows has already succeeded.
+    Return the number of bytes reclaimed.
+    """
+
+    try:
+        remove_trash(install_parent)
+    except OSError as error:
+        log('Failed to remove leftover trash: {0}'.format(error), 'WARNING')
+
+    protected = set(protected)
+
+    if os.path.exists(live_link_path):
+        protected.add(os.path.basename(os.path.realpath(live_link_path)))
+
+    releases = list_releases(install_parent)
+    expired = expired_releases(releases, keep, keep_days, protected)
+    remaining = set(releases) - set(expired)
+
+    orphans = orphaned_timestamps(
+        sites_available_dir, certs_dir, remaining
+    ) - protected
+
+    reclaimed = 0
+    removed = []
+
+    for timestamp in expired:
+        release_path = os.path.join(install_parent, timestamp)
+
+        log('Removing old release {0}'.format(release_path))
+
+        try:
+            size = disk_usage(release_path)
+            remove_tree(release_path)
+        except OSError as error:
+            log('Failed to remove {0}: {1}'.format(release_path, error),
+                'WARNING')
+            continue
+
+        reclaimed += size
+        removed.append(timestamp)
+
+    for timestamp in set(removed) | orphans:
+        for file_path in release_files(
+            timestamp, sites_available_dir, certs_dir
+        ):
+            if os.path.isfile(file_path):
+                log('Removing {0}'.format(file_path))
+
+                try:
+                    size = os.path.getsize(file_path)
+                    os.remove(file_path)
+                except OSError as error:
+                    log('Failed to remove {0}: {1}'.format(file_path, error),
+                        'WARNING')
+                    continue
+
+                reclaimed += size
+
+    log(
+        "Removed {count} old releases, reclaiming {mb:.1f} MB".format(
+            count=len(removed), mb=reclaimed / 1048576.0
+        )
+    )
+
+    return reclaimed
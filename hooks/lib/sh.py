@@ -907,6 +907,10 @@ class OProc(object):
             self.cmd = cmd
             self.exit_code = None
 
+            # set once the exit code is known, so threads can block on the
+            # process ending rather than polling for it
+            self._exited = threading.Event()
+
             self.stdin = stdin or Queue()
             self._pipe_queue = Queue()
 
@@ -1033,7 +1037,14 @@ class OProc(object):
             errors.append(stderr)
 
         while readers:
-            outputs, inputs, err = select.select(readers, [], errors, 0.1)
+            # block until there's output, rather than waking up to poll.
+            # only wake up early if we have to enforce a timeout
+            wait_time = None
+            if self.call_args["timeout"]:
+                wait_time = max(0, self.started + self.call_args["timeout"]
+                    - _time.time())
+
+            outputs, inputs, err = select.select(readers, [], errors, wait_time)
 
             # stdout and stderr
             for stream in outputs:
@@ -1064,8 +1075,7 @@ class OProc(object):
         # running, and closing the fd will cause some operation to
         # fail.  this is less complex than wrapping all the ops
         # in the above loop with out-of-band fd-close exceptions
-        while self.alive:
-            _time.sleep(0.001)
+        self._wait_for_exit()
 
         if stdout:
             stdout.close()
@@ -1109,6 +1119,33 @@ class OProc(object):
         elif os.WIFEXITED(exit_code): return os.WEXITSTATUS(exit_code)
         else: raise RuntimeError("Unknown child exit status!")
 
+    def _set_exit_code(self, exit_code):
+        self.exit_code = self._handle_exit_code(exit_code)
+        self._exited.set()
+
+        # wake up the input thread if it's waiting on an empty queue
+        if isinstance(self.stdin, Queue): self.stdin.put(ProcessExited)
+
+    def _wait_for_exit(self):
+        # block until the process ends.  if nobody else is waiting on the
+        # pid, reap it ourselves, otherwise wait for whoever is (.wait()
+        # in another thread) to tell us it's done
+        while self.exit_code is None:
+            if self._wait_lock.acquire(False):
+                try:
+                    if self.exit_code is None:
+                        pid, exit_code = os.waitpid(self.pid, 0)
+                        self._set_exit_code(exit_code)
+
+                # no child process
+                except OSError: return
+                finally: self._wait_lock.release()
+
+            # the lock may only be held for a moment by .alive, so check
+            # again now and then
+            else:
+                self._exited.wait(0.1)
+
     @property
     def alive(self):
         if self.exit_code is not None: return False
@@ -1133,7 +1170,7 @@ class OProc(object):
             # essentially polling the process
             pid, exit_code = os.waitpid(self.pid, os.WNOHANG)
             if pid == self.pid:
-                self.exit_code = self._handle_exit_code(exit_code)
+                self._set_exit_code(exit_code)
                 return False
 
         # no child process
@@ -1150,7 +1187,7 @@ class OProc(object):
             if self.exit_code is None:
                 self.log.debug("exit code not set, waiting on pid")
                 pid, exit_code = os.waitpid(self.pid, 0)
-                self.exit_code = self._handle_exit_code(exit_code)
+                self._set_exit_code(exit_code)
             else:
                 self.log.debug("exit code already set (%d), no need to wait", self.exit_code)
 
@@ -1167,6 +1204,10 @@ class OProc(object):
 class DoneReadingStdin(Exception): pass
 class NoStdinData(Exception): pass
 
+# put on a process's stdin queue when it exits, so the input thread stops
+# waiting for more input
+ProcessExited = object()
+
 
 
 # this guy is for reading from some input (the stream) and writing to our
@@ -1229,8 +1270,10 @@ class StreamWriter(object):
         return self.stream
 
     def get_queue_chunk(self):
-        try: chunk = self.stdin.get(True, 0.01)
-        except Empty: raise NoStdinData
+        # block until there's data.  OProc puts ProcessExited on the queue
+        # when the process ends, to wake us up
+        chunk = self.stdin.get()
+        if chunk is ProcessExited: raise NoStdinData
         if chunk is None: raise DoneReadingStdin
         return chunk
 
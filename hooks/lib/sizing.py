@@ -0,0 +1,100 @@
+from multiprocessing import cpu_count
+
+
+# Rough resident size we allow for each copy of the app,
+# to keep mod_wsgi processes from pushing the unit into swap
+memory_per_process_mb = 256
+
+# The same for each apache child process, which only serves static files
+# and hands requests to the daemon processes
+memory_per_child_mb = 32
+
+default_threads = 15
+
+
+def total_memory_mb(meminfo_path='/proc/meminfo'):
+    """
+    Read the unit's total memory, in MB, from /proc/meminfo
+    """
+
+    with open(meminfo_path) as meminfo:
+        for line in meminfo:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) // 1024
+
+    return 0
+
+
+def wsgi_daemon_settings(settings):
+    """
+    Work out the WSGIDaemonProcess options from config,
+    deriving processes and threads from the host where they're left as 0:
+    one process per CPU, as far as memory allows
+    """
+
+    processes = settings['wsgi_processes']
+    threads = settings['wsgi_threads']
+
+    if not processes:
+        memory_limit = total_memory_mb() // memory_per_process_mb
+        processes = max(1, min(cpu_count(), memory_limit))
+
+    if not threads:
+        threads = default_threads
+
+    return {
+        'processes': processes,
+        'threads': threads,
+        'maximum_requests': settings['wsgi_maximum_requests'],
+        'inactivity_timeout': settings['wsgi_inactivity_timeout'],
+        'queue_timeout': settings['wsgi_queue_timeout'],
+        'listen_backlog': settings['wsgi_listen_backlog'],
+        'display_name': settings['wsgi_display_name']
+    }
+
+
+def mpm_settings(settings, wsgi_daemon=None):
+    """
+    Work out MPM sizing from the host and the daemon process settings,
+    with any non-zero values in config taking precedence.
+
+    There should be enough apache threads for every daemon thread
+    to be busy with room to spare for static files and slow clients,
+    within a rough memory budget per apache child.
+    """
+
+    threads_per_child = settings['mpm_threads_per_child'] or 25
+    wanted_workers = threads_per_child * cpu_count()
+
+    if wsgi_daemon:
+        daemon_threads = wsgi_daemon['processes'] * wsgi_daemon['threads']
+        wanted_workers = max(wanted_workers, 2 * daemon_threads)
+
+    # Enough children for the wanted workers, rounding up
+    server_limit = -(-wanted_workers // threads_per_child)
+    memory_limit = total_memory_mb() // memory_per_child_mb
+    server_limit = max(2, min(server_limit, memory_limit))
+
+    server_limit = settings['mpm_server_limit'] or server_limit
+
+    max_request_workers = (
+        settings['mpm_max_request_workers'] or
+        server_limit * threads_per_child
+    )
+
+    # Only recycle children when they run app code themselves
+    max_connections_per_child = settings['mpm_max_connections_per_child']
+
+    if not max_connections_per_child and not wsgi_daemon:
+        max_connections_per_child = 10000
+
+    return {
+        'server_limit': server_limit,
+        'thread_limit': max(64, threads_per_child),
+        'threads_per_child': threads_per_child,
+        'max_request_workers': min(
+            max_request_workers, server_limit * threads_per_child
+        ),
+        'max_connections_per_child': max_connections_per_child,
+        'keepalive_timeout': settings['keepalive_timeout'] or 5
+    }
@@ -0,0 +1,73 @@
+from charmhelpers.core.host import log
+
+
+def dirty_stages(
+    settings, stage_inputs, stage_dependents, ignored=(),
+    changed_artifacts=None
+):
+    """
+    Work out which stages need to run by comparing config with the
+    previous snapshot (see charmhelpers.core.hookenv.Config)
+
+    `stage_inputs` maps each stage to the config keys it reads,
+    and `stage_dependents` maps each stage to the stages that must run
+    after it. Keys in `ignored` affect no stage.
+    A changed key that isn't mapped at all makes every stage dirty.
+    `changed_artifacts` maps stages to a description of the input
+    artifacts outside config (like the app tarball) which have changed
+    since they last ran, and makes those stages dirty too.
+
+    Return a dict of the stages to run, with the reason for each
+    """
+
+    if not settings.has_previous():
+        return dict(
+            (stage, 'no previous config') for stage in stage_inputs
+        )
+
+    changed_keys = settings.changed_keys()
+    mapped = set(ignored)
+    dirty = {}
+
+    for (stage, keys) in stage_inputs.items():
+        mapped.update(keys)
+        changed = changed_keys.intersection(keys)
+
+        if changed:
+            dirty[stage] = 'changed: ' + ', '.join(sorted(changed))
+
+    for (stage, description) in (changed_artifacts or {}).items():
+        if stage not in dirty:
+            dirty[stage] = 'changed: ' + description
+
+    unmapped = changed_keys - mapped
+
+    if unmapped:
+        reason = 'unmapped keys changed: ' + ', '.join(sorted(unmapped))
+
+        return dict((stage, reason) for stage in stage_inputs)
+
+    # Anything downstream of a dirty stage has to run too
+    queue = list(dirty)
+
+    while queue:
+        stage = queue.pop(0)
+
+        for dependent in stage_dependents.get(stage, []):
+            if dependent not in dirty:
+                dirty[dependent] = 'after {0}'.format(stage)
+                queue.append(dependent)
+
+    return dirty
+
+
+def log_stages(stages, dirty):
+    """
+    Log which stages will run and which are skipped, and why
+    """
+
+    for stage in stages:
+        if stage in dirty:
+            log('Running stage {0} ({1})'.format(stage, dirty[stage]))
+        else:
+            log('Skipping stage {0} (inputs unchanged)'.format(stage))
@@ -0,0 +1,294 @@
+import gzip
+import json
+import os
+import re
+from cStringIO import StringIO
+from hashlib import md5
+from shutil import copy2
+from multiprocessing import Pool, cpu_count
+from time import time
+from charmhelpers.core.host import log
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Text-based files worth compressing - images, fonts and archives
+# are mostly compressed already
+compressible_extensions = (
+    '.css', '.js', '.json', '.map', '.html', '.htm', '.svg', '.xml',
+    '.txt', '.ico', '.ttf', '.otf', '.eot'
+)
+
+# Below this, the compressed file plus headers won't be much smaller
+minimum_size = 256
+
+variant_extensions = ('.gz', '.br')
+
+# Matches the `static_max_age` rule in templates/wsgi-app.conf
+fingerprint_length = 10
+fingerprint_pattern = re.compile(r'\.[0-9a-f]{8,}\.[^.]+$')
+
+manifest_name = 'static-manifest.json'
+
+
+def compressible_files(static_dir):
+    """
+    Find the files under static_dir which should have compressed variants
+    """
+
+    for (root, dirs, files) in os.walk(static_dir):
+        for name in files:
+            file_path = os.path.join(root, name)
+
+            if (
+                name.lower().endswith(compressible_extensions) and
+                not os.path.islink(file_path) and
+                os.path.getsize(file_path) >= minimum_size
+            ):
+                yield file_path
+
+
+def write_variant(file_path, extension, compress, content):
+    """
+    Write a compressed variant beside the original, with the same mtime,
+    unless it's no smaller or an up-to-date one already exists.
+    Return the size of the variant, or the original size if none was kept.
+    """
+
+    variant_path = file_path + extension
+    original_mtime = os.path.getmtime(file_path)
+
+    if (
+        os.path.isfile(variant_path) and
+        os.path.getmtime(variant_path) == original_mtime
+    ):
+        return os.path.getsize(variant_path)
+
+    compressed = compress(content, original_mtime)
+
+    if len(compressed) >= len(content):
+        return len(content)
+
+    temp_path = '{0}.tmp-{1}'.format(variant_path, os.getpid())
+
+    with open(temp_path, 'wb') as variant:
+        variant.write(compressed)
+
+    os.utime(temp_path, (original_mtime, original_mtime))
+    os.rename(temp_path, variant_path)
+
+    return len(compressed)
+
+
+def gzip_compress(content, mtime):
+    compressed = StringIO()
+
+    with gzip.GzipFile(
+        '', 'wb', compresslevel=9, fileobj=compressed, mtime=mtime
+    ) as gzip_file:
+        gzip_file.write(content)
+
+    return compressed.getvalue()
+
+
+def brotli_compress(content, mtime):
+    return brotli.compress(content)
+
+
+def compress_file(file_path):
+    """
+    Write .gz (and .br, if brotli is installed) variants of a file
+    Return the original size and the size of each variant
+    """
+
+    with open(file_path, 'rb') as original:
+        content = original.read()
+
+    gzip_size = write_variant(file_path, '.gz', gzip_compress, content)
+    brotli_size = len(content)
+
+    if brotli:
+        brotli_size = write_variant(
+            file_path, '.br', brotli_compress, content
+        )
+
+    return (len(content), gzip_size, brotli_size)
+
+
+def precompress(static_dir, processes=None):
+    """
+    Write compressed variants of every compressible file in static_dir,
+    spread across a pool of processes,
+    and log how many bytes they save
+    """
+
+    start = time()
+    files = list(compressible_files(static_dir))
+
+    if not files:
+        return
+
+    pool = Pool(processes or cpu_count())
+
+    try:
+        sizes = pool.map(compress_file, files)
+    finally:
+        pool.close()
+        pool.join()
+
+    original_total = sum(size[0] for size in sizes)
+    gzip_total = sum(size[1] for size in sizes)
+    brotli_total = sum(size[2] for size in sizes)
+
+    report = (
+        "Precompressed {count} static files in {seconds:.2f}s: "
+        "{original:.1f} MB, gzip saves {gzip:.1f} MB"
+    ).format(
+        count=len(files),
+        seconds=time() - start,
+        original=original_total / 1048576.0,
+        gzip=(original_total - gzip_total) / 1048576.0
+    )
+
+    if brotli:
+        report += ", brotli saves {0:.1f} MB".format(
+            (original_total - brotli_total) / 1048576.0
+        )
+
+    log(report)
+
+
+def fingerprinted_name(relative_path, digest):
+    """
+    Insert a digest before a file's extension: app.js -> app.3f2a9c1d0e.js
+    """
+
+    (base, extension) = os.path.splitext(relative_path)
+
+    return '{0}.{1}{2}'.format(base, digest, extension)
+
+
+def load_manifest(manifest_path):
+    if manifest_path and os.path.isfile(manifest_path):
+        with open(manifest_path) as manifest_file:
+            try:
+                return json.load(manifest_file)
+            except ValueError:
+                log('Ignoring corrupt manifest {0}'.format(manifest_path))
+
+    return {'assets': {}, 'files': {}}
+
+
+def file_digest(file_path):
+    digest = md5()
+
+    with open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(65536), ''):
+            digest.update(chunk)
+
+    return digest.hexdigest()[:fingerprint_length]
+
+
+def is_variant(file_path):
+    """
+    Whether a file is a compressed variant of another file
+    """
+
+    (original_path, extension) = os.path.splitext(file_path)
+
+    return extension in variant_extensions and os.path.isfile(original_path)
+
+
+def link_file(source_path, target_path):
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        copy2(source_path, target_path)
+
+
+def fingerprint(static_dir, previous_manifest_path=None):
+    """
+    Link each file in static_dir to a name containing a hash of its
+    contents (along with its compressed variants),
+    and write a manifest mapping original names to fingerprinted ones.
+
+    Files which are the very same file as in the previous release's
+    manifest (hardlinked from it on extract, so the same inode on the
+    same device) reuse its hash rather than being read again.
+    Size and mtime alone aren't enough to go on, as tarballs built
+    with normalised mtimes can change a file without changing either.
+    """
+
+    start = time()
+    previous = load_manifest(previous_manifest_path)['files']
+    manifest = {'assets': {}, 'files': {}}
+    hashed = 0
+
+    for (root, dirs, files) in os.walk(static_dir):
+        for name in files:
+            file_path = os.path.join(root, name)
+            relative_path = os.path.relpath(file_path, static_dir)
+
+            if (
+                name == manifest_name or
+                fingerprint_pattern.search(name) or
+                is_variant(file_path) or
+                os.path.islink(file_path)
+            ):
+                continue
+
+            stats = os.stat(file_path)
+            known = previous.get(relative_path)
+
+            if (
+                known and
+                known.get('inode') == stats.st_ino and
+                known.get('device') == stats.st_dev and
+                known['size'] == stats.st_size
+            ):
+                digest = known['digest']
+            else:
+                digest = file_digest(file_path)
+                hashed += 1
+
+            fingerprinted_path = fingerprinted_name(relative_path, digest)
+
+            for extension in ('',) + variant_extensions:
+                if os.path.isfile(file_path + extension):
+                    link_file(
+                        file_path + extension,
+                        os.path.join(
+                            static_dir, fingerprinted_path + extension
+                        )
+                    )
+
+            manifest['assets'][relative_path] = fingerprinted_path
+            manifest['files'][relative_path] = {
+                'size': stats.st_size,
+                'mtime': int(stats.st_mtime),
+                'inode': stats.st_ino,
+                'device': stats.st_dev,
+                'digest': digest
+            }
+
+    manifest_path = os.path.join(static_dir, manifest_name)
+
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    log(
+        "Fingerprinted {count} static files in {seconds:.2f}s "
+        "({hashed} hashed, the rest reused from the previous release)".format(
+            count=len(manifest['assets']),
+            hashed=hashed,
+            seconds=time() - start
+        )
+    )
+
+    return manifest_path
@@ -0,0 +1,431 @@
+import os
+import sys
+import tarfile
+import zlib
+from collections import deque
+from shutil import copyfile
+from stat import S_IMODE
+from time import time
+from urllib2 import urlopen
+from charmhelpers.core.host import log
+
+
+chunk_size = 64 * 1024
+
+
+class MeteredReader(object):
+    """
+    Wrap a file-like object, counting the bytes read from it
+    and the time spent waiting on it
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        start = time()
+        data = self.fileobj.read(size)
+        self.seconds += time() - start
+        self.bytes += len(data)
+
+        return data
+
+
+class GunzipReader(object):
+    """
+    Decompress a gzip stream on the fly
+    without needing to seek in the underlying file
+    (so it can read directly from an HTTP response)
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # Decompressed data waiting to be read, as a queue of chunks,
+        # with the position already read up to in the first one,
+        # so reads never copy more than they return
+        self.chunks = deque()
+        self.offset = 0
+        self.buffered = 0
+        self.finished = False
+
+    def _append(self, data):
+        if data:
+            self.chunks.append(data)
+            self.buffered += len(data)
+
+    def _fill(self, size):
+        while not self.finished and (size < 0 or self.buffered < size):
+            compressed = self.fileobj.read(chunk_size)
+
+            if not compressed:
+                self._append(self.decompressor.flush())
+                self.finished = True
+                break
+
+            self._append(self.decompressor.decompress(compressed))
+
+            # Concatenated gzip members: start a new decompressor
+            leftover = self.decompressor.unused_data
+            while leftover:
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self._append(self.decompressor.decompress(leftover))
+                leftover = self.decompressor.unused_data
+
+    def read(self, size=-1):
+        self._fill(size)
+
+        if size < 0 or size > self.buffered:
+            size = self.buffered
+
+        parts = []
+        needed = size
+
+        while needed:
+            chunk = self.chunks[0]
+            end = min(len(chunk), self.offset + needed)
+            parts.append(chunk[self.offset:end])
+            needed -= end - self.offset
+
+            if end == len(chunk):
+                self.chunks.popleft()
+                self.offset = 0
+            else:
+                self.offset = end
+
+        self.buffered -= size
+
+        return ''.join(parts)
+
+
+def strip_path(name, strip):
+    """
+    Remove the first `strip` components from a member path,
+    like tar's --strip-components.
+    Return None if nothing is left.
+    """
+
+    parts = [part for part in name.split('/') if part and part != '.']
+
+    if len(parts) <= strip:
+        return None
+
+    return '/'.join(parts[strip:])
+
+
+def safe_member(member, strip):
+    """
+    Rewrite a tar member's paths for extraction with `strip` components
+    removed, or return None if it should be skipped
+    """
+
+    name = strip_path(member.name, strip)
+
+    if not name or name.startswith('/') or '..' in name.split('/'):
+        return None
+
+    member.name = name
+
+    if member.islnk():
+        # Hard link targets are paths within the archive, so strip them too
+        linkname = strip_path(member.linkname, strip)
+
+        if (
+            not linkname or member.linkname.startswith('/') or
+            '..' in linkname.split('/')
+        ):
+            return None
+
+        member.linkname = linkname
+
+    return member
+
+
+class UnsafeMemberError(ValueError):
+    pass
+
+
+def within(file_path, root):
+    """
+    Whether a path is inside `root` (already resolved with realpath)
+    once any symlinks along it are resolved
+    """
+
+    resolved = os.path.realpath(file_path)
+
+    return resolved == root or resolved.startswith(root + os.sep)
+
+
+def check_target(member, install_path):
+    """
+    Make sure extracting a member into `install_path` (already resolved
+    with realpath) can only write inside it:
+    its parent directory must resolve inside the tree,
+    links must point inside the tree,
+    and existing symlinks are never replaced or written through,
+    so the links checked so far keep pointing where they did.
+    Raise UnsafeMemberError otherwise
+    """
+
+    target_path = os.path.join(install_path, member.name)
+    parent_path = os.path.dirname(target_path)
+
+    if member.issym():
+        link_target = os.path.join(parent_path, member.linkname)
+    elif member.islnk():
+        link_target = os.path.join(install_path, member.linkname)
+    else:
+        link_target = install_path
+
+    if (
+        not within(link_target, install_path) or
+        not within(parent_path, install_path) or
+        os.path.islink(target_path)
+    ):
+        raise UnsafeMemberError(
+            "Refusing to extract '{0}' outside '{1}'".format(
+                member.name, install_path
+            )
+        )
+
+
+def copy_bytes(source, target, count=None):
+    """
+    Copy `count` bytes (or everything) from one file object to another
+    """
+
+    while count is None or count > 0:
+        size = chunk_size if count is None else min(chunk_size, count)
+        data = source.read(size)
+
+        if not data:
+            break
+
+        target.write(data)
+
+        if count is not None:
+            count -= len(data)
+
+
+def reusable(member, previous_file, previous_path):
+    """
+    Whether a file from a previous release could stand in for a member:
+    a regular file with the same size and permissions,
+    reached without following a symlink out of the previous release
+    (`previous_path`, already resolved with realpath)
+    """
+
+    if (
+        os.path.islink(previous_file) or
+        not os.path.isfile(previous_file) or
+        not within(previous_file, previous_path)
+    ):
+        return False
+
+    stats = os.stat(previous_file)
+
+    return (
+        stats.st_size == member.size and
+        S_IMODE(stats.st_mode) == member.mode & 07777
+    )
+
+
+def extract_or_link(archive, member, install_path, previous_file):
+    """
+    Compare a regular file member with the same file in a previous release.
+    If the contents are identical, hardlink the previous file into place.
+    Otherwise write the member out, copying the prefix we've already
+    compared from the previous file, since the stream can't be rewound.
+    Return True if the previous file was reused.
+    """
+
+    target_path = os.path.join(install_path, member.name)
+    source = archive.extractfile(member)
+    matched = 0
+
+    if not os.path.isdir(os.path.dirname(target_path)):
+        os.makedirs(os.path.dirname(target_path))
+
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+
+    with open(previous_file, 'rb') as previous:
+        while True:
+            data = source.read(chunk_size)
+
+            if not data:
+                break
+
+            if previous.read(len(data)) != data:
+                previous.seek(0)
+
+                with open(target_path, 'wb') as target:
+                    copy_bytes(previous, target, matched)
+                    target.write(data)
+                    copy_bytes(source, target)
+
+                archive.chown(member, target_path)
+                archive.chmod(member, target_path)
+                archive.utime(member, target_path)
+
+                return False
+
+            matched += len(data)
+
+    try:
+        os.link(previous_file, target_path)
+    except OSError:
+        # Probably a different filesystem, so copy instead
+        copyfile(previous_file, target_path)
+        archive.chown(member, target_path)
+        archive.chmod(member, target_path)
+        archive.utime(member, target_path)
+
+    return True
+
+
+def extract_stream(fileobj, install_path, strip=1, previous_path=None):
+    """
+    Extract a tar stream into install_path, member by member,
+    honouring tar's --strip-components semantics.
+    Members which would be written outside install_path
+    raise UnsafeMemberError (see `check_target`).
+
+    If `previous_path` is given, files identical to those in that
+    directory are hardlinked from it instead of being written again.
+
+    Return the number of bytes written and the number reused.
+    """
+
+    bytes_written = 0
+    bytes_reused = 0
+    install_path = os.path.realpath(install_path)
+
+    if previous_path:
+        previous_path = os.path.realpath(previous_path)
+
+    archive = tarfile.open(fileobj=fileobj, mode='r|')
+
+    for member in archive:
+        member = safe_member(member, strip)
+
+        if member is None:
+            continue
+
+        check_target(member, install_path)
+
+        if member.isfile() and previous_path:
+            previous_file = os.path.join(previous_path, member.name)
+
+            if reusable(member, previous_file, previous_path):
+                if extract_or_link(
+                    archive, member, install_path, previous_file
+                ):
+                    bytes_reused += member.size
+                else:
+                    bytes_written += member.size
+
+                continue
+
+        archive.extract(member, install_path)
+
+        if member.isfile():
+            bytes_written += member.size
+
+    archive.close()
+
+    if previous_path:
+        log(
+            "Wrote {written:.1f} MB, reused {reused:.1f} MB "
+            "by hardlinking from {previous}".format(
+                written=bytes_written / 1048576.0,
+                reused=bytes_reused / 1048576.0,
+                previous=previous_path
+            )
+        )
+
+    return (bytes_written, bytes_reused)
+
+
+def extract_file(tgz_path, install_path, strip=1, previous_path=None):
+    """
+    Extract a gzipped tarball from disk with extract_stream
+    """
+
+    with open(tgz_path, 'rb') as tgz_file:
+        return extract_stream(
+            GunzipReader(tgz_file), install_path, strip, previous_path
+        )
+
+
+def stage_report(name, byte_count, seconds):
+    """
+    Format a stage's throughput for the log
+    """
+
+    rate = byte_count / seconds if seconds > 0 else 0
+
+    return "{name}: {mb:.1f} MB in {seconds:.2f}s ({rate:.1f} MB/s)".format(
+        name=name,
+        mb=byte_count / 1048576.0,
+        seconds=seconds,
+        rate=rate / 1048576.0
+    )
+
+
+def stream_extract_url(
+    url, install_path, strip=1, opener=urlopen, previous_path=None
+):
+    """
+    Download a gzipped tarball and extract it in a single pass,
+    feeding the HTTP response through a decompressor
+    straight into the tar extractor, without a temporary file.
+    Log the throughput and wall time of each stage.
+
+    `opener` is called with the URL to get the file-like source,
+    which is closed once extraction is finished.
+    If extraction fails, the source is abandoned with its `discard`
+    method if it has one, or closed, and the original error is raised.
+    `previous_path` is passed on to extract_stream.
+    """
+
+    start = time()
+
+    source = opener(url)
+
+    try:
+        network = MeteredReader(source)
+        decompressed = MeteredReader(GunzipReader(network))
+
+        (bytes_written, bytes_reused) = extract_stream(
+            decompressed, install_path, strip, previous_path
+        )
+    except Exception:
+        error = sys.exc_info()
+
+        try:
+            getattr(source, 'discard', source.close)()
+        except Exception as close_error:
+            log('Failed to close {0}: {1}'.format(url, close_error))
+
+        raise error[0], error[1], error[2]
+
+    source.close()
+
+    total_seconds = time() - start
+
+    # Each reader's time includes the time of the readers below it
+    decompress_seconds = decompressed.seconds - network.seconds
+    extract_seconds = total_seconds - decompressed.seconds
+
+    log(stage_report('Download', network.bytes, network.seconds))
+    log(stage_report('Decompress', decompressed.bytes, decompress_seconds))
+    log(stage_report('Extract', bytes_written, extract_seconds))
+    log("Streamed '{url}' to '{dir}' in {seconds:.2f}s".format(
+        url=url, dir=install_path, seconds=total_seconds
+    ))
+
+    return install_path
+
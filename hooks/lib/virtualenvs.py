@@ -0,0 +1,199 @@
+import os
+import shutil
+from filecmp import cmp
+from hashlib import sha256
+from time import time
+import sh
+from fileops import link_tree, remove_path
+from helpers import run
+from charmhelpers.core.host import log
+
+
+# Written into a wheelhouse once all its wheels are built
+complete_marker = '.complete'
+
+# Written into a virtualenv once its requirements are installed
+venv_marker = '.requirements-digest'
+
+
+def requirements_digest(requirements_path):
+    """
+    A digest of the requirements file's contents
+    """
+
+    with open(requirements_path, 'rb') as requirements:
+        return sha256(requirements.read()).hexdigest()
+
+
+def build_wheelhouse(requirements_path, wheelhouse_dir, find_links, no_index):
+    """
+    Build wheels for everything in a requirements file into
+    a directory named after the file's digest, unless that's already done
+    Return the directory
+    """
+
+    wheel_dir = os.path.join(
+        wheelhouse_dir, requirements_digest(requirements_path)
+    )
+    marker_path = os.path.join(wheel_dir, complete_marker)
+
+    if os.path.isfile(marker_path):
+        log('Reusing wheels from {0}'.format(wheel_dir))
+        return wheel_dir
+
+    start = time()
+
+    if not os.path.isdir(wheel_dir):
+        os.makedirs(wheel_dir)
+
+    options = {
+        'wheel_dir': wheel_dir,
+        'find_links': find_links,
+        'no_index': no_index
+    }
+
+    run(sh.pip.wheel, r=requirements_path, **options)
+
+    open(marker_path, 'w').close()
+
+    log("Built wheels into {dir} in {seconds:.1f}s".format(
+        dir=wheel_dir, seconds=time() - start
+    ))
+
+    return wheel_dir
+
+
+def create_virtualenv(
+    venv_path, requirements_path, wheelhouse_dir, find_links, no_index,
+    previous_venv=None, previous_requirements=None
+):
+    """
+    Create a virtualenv for a release and install its requirements,
+    from the wheelhouse
+
+    If the previous release's requirements file is byte-identical,
+    hardlink its virtualenv instead, and point it at its new path
+    (see `relocate_virtualenv`)
+    """
+
+    has_requirements = os.path.isfile(requirements_path)
+    digest = requirements_digest(requirements_path) if has_requirements else ''
+    marker_path = os.path.join(venv_path, venv_marker)
+
+    if os.path.isfile(marker_path):
+        with open(marker_path) as marker:
+            if marker.read() == digest:
+                log('Virtualenv {0} is already complete'.format(venv_path))
+                return
+
+    # Start afresh if a previous attempt was interrupted
+    if os.path.exists(venv_path):
+        remove_path(venv_path)
+
+    if (
+        previous_venv and os.path.isdir(previous_venv) and
+        previous_requirements and os.path.isfile(previous_requirements) and
+        has_requirements and
+        cmp(requirements_path, previous_requirements, shallow=False)
+    ):
+        log('Requirements unchanged, reusing {0}'.format(previous_venv))
+        link_tree(previous_venv, venv_path)
+        relocate_virtualenv(venv_path, os.path.realpath(previous_venv))
+    else:
+        install_virtualenv(
+            venv_path, requirements_path, wheelhouse_dir, find_links, no_index
+        )
+
+    with open(marker_path, 'w') as marker:
+        marker.write(digest)
+
+
+def relocate_virtualenv(venv_path, previous_path):
+    """
+    Replace the previous virtualenv's absolute path with `venv_path`
+    wherever a virtualenv copied from it names it:
+    script shebangs and activate scripts in bin, .pth and .egg-link files,
+    and symlinks. Otherwise the copy would break
+    once the previous release is removed.
+    Rewritten files are replaced rather than edited in place,
+    since they're hardlinked to the previous virtualenv's
+    """
+
+    rewritten = 0
+
+    for (root, dirs, files) in os.walk(venv_path):
+        in_bin = root == os.path.join(venv_path, 'bin')
+
+        for name in files + dirs:
+            file_path = os.path.join(root, name)
+
+            if os.path.islink(file_path):
+                target = os.readlink(file_path)
+
+                if target.startswith(previous_path):
+                    os.remove(file_path)
+                    os.symlink(
+                        target.replace(previous_path, venv_path, 1), file_path
+                    )
+                    rewritten += 1
+            elif name in files and (
+                in_bin or name.endswith(('.pth', '.egg-link'))
+            ):
+                if rewrite_path(file_path, previous_path, venv_path):
+                    rewritten += 1
+
+    log('Relocated {count} files in {venv} from {previous}'.format(
+        count=rewritten, venv=venv_path, previous=previous_path
+    ))
+
+
+def rewrite_path(file_path, old_path, new_path):
+    """
+    Replace a text file with a copy naming `new_path` instead of
+    `old_path`, keeping its ownership and permissions
+    Return True if the file named `old_path`
+    """
+
+    with open(file_path, 'rb') as source:
+        content = source.read()
+
+    # Leave binaries, like the python executable, alone
+    if old_path not in content or '\0' in content:
+        return False
+
+    temp_path = '{0}.tmp-{1}'.format(file_path, os.getpid())
+    stats = os.stat(file_path)
+
+    with open(temp_path, 'wb') as target:
+        target.write(content.replace(old_path, new_path))
+
+    os.chown(temp_path, stats.st_uid, stats.st_gid)
+    shutil.copystat(file_path, temp_path)
+    os.rename(temp_path, file_path)
+
+    return True
+
+
+def install_virtualenv(
+    venv_path, requirements_path, wheelhouse_dir, find_links, no_index
+):
+    """
+    Create a new virtualenv and install requirements into it from wheels
+    """
+
+    log('Creating virtualenv {0}'.format(venv_path))
+    run(sh.virtualenv, venv_path)
+
+    if os.path.isfile(requirements_path):
+        wheel_dir = build_wheelhouse(
+            requirements_path, wheelhouse_dir, find_links, no_index
+        )
+
+        venv_pip = sh.Command(os.path.join(venv_path, 'bin', 'pip'))
+
+        run(
+            venv_pip.install,
+            r=requirements_path,
+            find_links=wheel_dir,
+            no_index=True
+        )
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 
+import grp
+import json
+import pwd
 import sys
 from urllib import urlretrieve
-from os import path, listdir, remove
+from urllib2 import urlopen
+from os import chmod, chown, path, listdir, readlink, remove, utime
+from shutil import copy
 from base64 import b64decode
 from datetime import datetime
+from time import time
 
 # Add ./lib to path
 lib_dir = path.join(path.dirname(__file__), 'lib')
@@ -12,9 +18,26 @@ sys.path.append(lib_dir)
 
 import sh
 from jinja2 import Environment, FileSystemLoader
-from helpers import create_dir, install_packages, parent_dir, run
-from charmhelpers.core.host import service_restart, service_stop
-from charmhelpers.core.hookenv import config
+from helpers import (
+    atomic_symlink, create_dir, install_packages, parent_dir, run, warm_up
+)
+from fileops import remove_path, restore_paths, snapshot_paths
+from tarball import extract_file, stream_extract_url
+from artifact_cache import ArtifactCache, file_sha256, remote_fingerprint
+from releases import collect_garbage
+from sizing import mpm_settings, wsgi_daemon_settings
+from static_assets import fingerprint, manifest_name, precompress
+from virtualenvs import create_virtualenv
+from dependency_cache import dependencies_digest, load_record, save_record
+from stages import dirty_stages, log_stages
+from environment import parse_variables, set_variables
+from charmhelpers.core.host import (
+    service_reload, service_restart, service_stop
+)
+from charmhelpers.contrib.charmsupport.nrpe import NRPE
+from charmhelpers.core.hookenv import (
+    config, log_to_file, related_units, relation_get, relation_ids
+)
 from charmhelpers.core.host import log
 
 
@@ -23,40 +46,349 @@ install_parent = "/srv"
 live_link_name = "current"
 live_link_path = path.join(install_parent, live_link_name)
 charm_dir = parent_dir(__file__)
-scriptrc_path = path.join(charm_dir, 'scripts/scriptrc')
 apache_dir = "/etc/apache2"
 sites_enabled_dir = path.join(apache_dir, "sites-enabled")
 sites_enabled_path = path.join(sites_enabled_dir, "wsgi-app.conf")
 sites_available_dir = path.join(apache_dir, "sites-available")
+mods_enabled_dir = path.join(apache_dir, "mods-enabled")
+conf_enabled_dir = path.join(apache_dir, "conf-enabled")
+mpm_conf_name = "wsgi-app-mpm"
+mpm_conf_path = path.join(
+    apache_dir, "conf-available", mpm_conf_name + ".conf"
+)
+mpm_modules = ['mpm_event', 'mpm_worker', 'mpm_prefork']
+artifact_cache_dir = path.join(charm_dir, 'cache')
+wheelhouse_dir = path.join(charm_dir, 'cache', 'wheelhouse')
+venv_name = '.venv'
+certs_dir = '/etc/ssl/certs'
 timefile_name = '.timestamp.txt'
+# Saved in each release, identifying the tarball it was extracted from
+app_tgz_record_name = '.app-tgz.json'
+access_log_stats_script = path.join(charm_dir, 'scripts/access_log_stats.py')
+access_log_cron_path = '/etc/cron.d/wsgi-app-access-log'
+server_status_script = path.join(
+    charm_dir, 'scripts/server_status_collector.py'
+)
+server_status_cron_path = '/etc/cron.d/wsgi-app-server-status'
+server_status_summary_path = '/var/lib/wsgi-app/server-status.json'
+profiler_path = path.join(charm_dir, 'scripts/wsgi_profiler.py')
+profiles_dir = '/var/lib/wsgi-app/profiles'
+wsgi_wrapper_name = '.wsgi-app-wrapper.py'
+environment_store_path = '/var/lib/wsgi-app/environment.json'
+# Relations whose hostname is given to the app, and the variable for each
+relation_hostname_variables = [
+    ('mongodb', 'MONGODB_HOSTNAME'),
+    ('http', 'HTTP_SERVER_HOSTNAME')
+]
+# Earlier versions of the charm made apache source scripts/scriptrc
+apache_envvars_path = path.join(apache_dir, 'envvars')
+scriptrc_link_comment = '# scriptrc link added by apache2-wsgi charm:'
+nagios_plugin_source = path.join(charm_dir, 'scripts/check_wsgi_app.py')
+nagios_plugin_path = '/usr/local/lib/nagios/plugins/check_wsgi_app'
+# Left behind by earlier versions of the nrpe-external-master hook
+stale_nrpe_configs = ['/etc/nagios/nrpe.d/check_fenchurch.cfg']
+
+# The stages of config_changed, in order,
+# with the config keys each one depends on
+stages = [
+    'packages', 'fetch', 'static', 'deps', 'env', 'ssl', 'vhost', 'restart',
+    'cleanup'
+]
+stage_inputs = {
+    'packages': ['apt_dependencies'],
+    'fetch': ['app_tgz_url', 'app_tgz_sha256'],
+    'static': ['static_path', 'static_precompress', 'static_fingerprint'],
+    'deps': [
+        'pip_requirements_path', 'pip_cache_path', 'pip_no_index',
+        'pip_virtualenv'
+    ],
+    'env': ['environment_variables'],
+    'ssl': ['ssl_keyfile', 'ssl_certificate'],
+    'vhost': [
+        'wsgi_file_path', 'wsgi_app_name', 'wsgi_daemon_mode',
+        'wsgi_processes', 'wsgi_threads', 'wsgi_maximum_requests',
+        'wsgi_inactivity_timeout', 'wsgi_queue_timeout',
+        'wsgi_listen_backlog', 'wsgi_display_name', 'wsgi_preload',
+        'wsgi_profiler', 'wsgi_profiler_slow_ms', 'wsgi_profiler_interval_ms',
+        'wsgi_profiler_keep',
+        'apache_mpm', 'mpm_server_limit', 'mpm_threads_per_child',
+        'mpm_max_request_workers', 'mpm_max_connections_per_child',
+        'keepalive_timeout', 'apache_conf_path', 'https_serve_directly',
+        'static_url_path', 'static_path', 'static_precompress',
+        'static_max_age', 'pip_virtualenv'
+    ],
+    'restart': [],
+    'cleanup': ['keep_releases', 'keep_releases_days']
+}
+# The stages which must follow each stage
+# Static files and dependencies are written into the release,
+# so rather than changing the live one, they make a new release
+stage_dependents = {
+    'packages': ['restart'],
+    'fetch': ['static', 'deps', 'env', 'ssl', 'vhost', 'cleanup'],
+    'static': ['fetch', 'env'],
+    'deps': ['fetch'],
+    'ssl': ['vhost'],
+    'vhost': ['restart']
+}
+# Config which only affects later deploys or other hooks
+unstaged_keys = [
+    'stream_app_tgz', 'app_tgz_cache_size', 'hardlink_unchanged_files',
+    'graceful_reload', 'warmup_urls', 'server_name', 'nagios_check_uri',
+    'nagios_check_string', 'nagios_environment', 'hook_log_file',
+    'nagios_response_warning', 'nagios_response_critical',
+    'nagios_p99_warning', 'nagios_p99_critical', 'nagios_queue_warning',
+    'nagios_queue_critical', 'nagios_workers_warning',
+    'nagios_workers_critical'
+]
+
+# Keep a structured record of what each hook did, alongside juju's log
+log_to_file(config('hook_log_file'))
 
 
 def install():
-    # Install charm dependencies
-    install_packages('python-pip apache2 libapache2-mod-wsgi')
+    # Install charm dependencies and any extra packages together
+    install_packages(
+        'python-pip python-virtualenv python-wheel apache2 '
+        'libapache2-mod-wsgi',
+        config('apt_dependencies')
+    )
+
+    setup_access_log_stats()
+    setup_server_status_collector()
+
+
+def setup_access_log_stats():
+    """
+    Summarise the access log every minute,
+    for monitoring to read (see scripts/access_log_stats.py)
+    """
+
+    log('Writing {0}'.format(access_log_cron_path))
+
+    with open(access_log_cron_path, 'w') as cron_file:
+        cron_file.write(
+            '* * * * * root /usr/bin/python {0} > /dev/null\n'.format(
+                access_log_stats_script
+            )
+        )
 
-    # Make sure extra packages are installed
-    install_packages(config('apt_dependencies'))
+
+def setup_server_status_collector():
+    """
+    Sample apache's worker usage through each minute,
+    for monitoring and the web-server relation to read
+    (see scripts/server_status_collector.py)
+    """
+
+    log('Writing {0}'.format(server_status_cron_path))
+
+    with open(server_status_cron_path, 'w') as cron_file:
+        cron_file.write(
+            '* * * * * root /usr/bin/python {0} > /dev/null\n'.format(
+                server_status_script
+            )
+        )
 
 
 def config_changed():
-    # Make sure required packages are installed
-    install_packages(config('apt_dependencies'))
+    """
+    Deploy the app, only running the stages
+    whose inputs have changed since the last successful run
+    """
 
     app_tgz_url = config('app_tgz_url')
+    app_tgz_version = None
+    artifacts = {}
 
     if app_tgz_url:
-        timestamp = get_timestamp()
+        app_tgz_version = app_tgz_fingerprint(app_tgz_url)
+        artifacts = changed_artifacts(app_tgz_url, app_tgz_version)
+
+    dirty = dirty_stages(
+        config(), stage_inputs, stage_dependents, unstaged_keys, artifacts
+    )
+
+    if not path.exists(live_link_path):
+        dirty = dict((stage, 'no live release') for stage in stages)
+
+    log_stages(stages, dirty)
+
+    # Make sure required packages are installed
+    if 'packages' in dirty:
+        install_packages(config('apt_dependencies'))
+
+    if app_tgz_url:
+        if 'fetch' in dirty:
+            timestamp = get_timestamp()
+        else:
+            timestamp = path.basename(path.realpath(live_link_path))
+
+        app_dir = path.join(install_parent, timestamp)
+        env_changed = False
+        apache_changed = False
+
+        if 'fetch' in dirty:
+            extract_app_files(app_tgz_url, timestamp)
+            save_app_tgz_record(app_dir, app_tgz_url, app_tgz_version)
+
+        if 'static' in dirty:
+            env_changed = prepare_static_files(app_dir)
+
+        if 'deps' in dirty:
+            install_dependencies(timestamp)
+
+        if 'env' in dirty:
+            env_changed = save_environment_variables_string(
+                config('environment_variables')
+            ) or env_changed
+
+            # The app can pick up its new environment without an apache
+            # restart, if there's not going to be one anyway
+            if env_changed and 'restart' not in dirty:
+                reload_environment()
+
+        # Without a new release, the ssl and vhost stages rewrite the live
+        # release's apache config in place, so keep what they replace,
+        # to put back if apache rejects the new config
+        replaced = None
+
+        if 'fetch' not in dirty and ('ssl' in dirty or 'vhost' in dirty):
+            replaced = snapshot_paths(
+                release_config_paths(timestamp),
+                [mods_enabled_dir, conf_enabled_dir]
+            )
+
+        if 'ssl' in dirty:
+            copy_ssl_certificates(timestamp)
+
+        if 'vhost' in dirty:
+            apache_changed = setup_apache_wsgi(timestamp, app_dir)
+
+        if 'restart' in dirty:
+            set_current(
+                timestamp, full_restart=apache_changed, replaced=replaced
+            )
+
+        if 'cleanup' in dirty:
+            remove_old_releases(timestamp)
+
+        if 'fetch' in dirty:
+            # This release is done, so the next one gets a new timestamp
+            remove_timestamp()
+
+    if relation_ids('nrpe-external-master'):
+        update_nrpe_config()
+
+    # Remember this config, for comparison in later hooks
+    config().save()
+
+
+def upgrade_charm():
+    """
+    Install any new charm dependencies
+    and forget the previous config, so the next config_changed
+    redeploys with the new charm's templates
+    (which also sets the environment variables from config again)
+    """
+
+    install()
+    import_relation_hostnames()
+    remove_scriptrc_link()
+
+    settings = config()
+
+    if path.exists(settings.path):
+        remove(settings.path)
+
+
+def import_relation_hostnames():
+    """
+    Store the hostnames of existing relations as environment variables.
+    Earlier versions of the charm exported them from scripts/scriptrc,
+    which upgrades can replace, so read them from the relations again
+    """
+
+    for (relation_name, variable_name) in relation_hostname_variables:
+        for relation_id in relation_ids(relation_name):
+            for unit in related_units(relation_id):
+                hostname = relation_get('hostname', unit, relation_id)
+
+                if hostname:
+                    save_environment_variable(variable_name, hostname.strip())
+
+
+def remove_scriptrc_link():
+    """
+    Stop apache sourcing scripts/scriptrc from envvars,
+    as earlier versions of the charm set it up to
+    """
+
+    with open(apache_envvars_path) as envvars:
+        lines = envvars.readlines()
+
+    if scriptrc_link_comment + '\n' not in lines:
+        return
+
+    log('Removing the scriptrc link from {0}'.format(apache_envvars_path))
+
+    index = lines.index(scriptrc_link_comment + '\n')
+
+    # The comment is followed by the line which sources scriptrc
+    del lines[index:index + 2]
+
+    with open(apache_envvars_path, 'w') as envvars:
+        envvars.writelines(lines)
+
+
+def app_tgz_fingerprint(url):
+    """
+    What identifies the current version of the app tarball:
+    its sha256 if config pins one, otherwise what the server says about it
+    (see `remote_fingerprint`)
+    """
+
+    return config('app_tgz_sha256') or remote_fingerprint(url)
+
+
+def changed_artifacts(url, version):
+    """
+    The stages whose input artifacts have changed since the live release
+    was deployed, for `dirty_stages`:
+    fetch, if the app tarball isn't the one the live release came from.
+    Dependencies and static files are inside the tarball,
+    so they follow from fetch
+    """
 
-        app_dir = extract_app_files(app_tgz_url, timestamp)
+    if not path.exists(live_link_path):
+        return {}
 
-        install_dependencies(timestamp)
+    if not version:
+        log("Can't tell whether '{0}' has changed".format(url))
+        return {}
 
-        save_environment_variables_string(config('environment_variables'))
+    recorded = load_app_tgz_record(live_link_path)
 
-        setup_apache_wsgi(timestamp, app_dir)
+    if recorded != {'url': url, 'fingerprint': version}:
+        return {'fetch': 'app tarball at {0}'.format(url)}
 
-        set_current(timestamp)
+    return {}
+
+
+def load_app_tgz_record(release_path):
+    record_path = path.join(release_path, app_tgz_record_name)
+
+    if path.isfile(record_path):
+        with open(record_path) as record:
+            try:
+                return json.load(record)
+            except ValueError:
+                pass
+
+
+def save_app_tgz_record(release_path, url, version):
+    with open(path.join(release_path, app_tgz_record_name), 'w') as record:
+        json.dump({'url': url, 'fingerprint': version}, record)
 
 
 def get_timestamp():
@@ -95,7 +427,9 @@ def extract_app_files(url, timestamp):
 
     # Unless install dir already exists, extract it
     if not (path.exists(install_path) and listdir(install_path)):
-        tempfile_path = '/tmp/wsgi-app-package.tgz'
+        cache = artifact_cache()
+        expected_sha256 = config('app_tgz_sha256') or None
+        previous_path = previous_release(install_path)
 
         create_dir(install_path)
 
@@ -105,21 +439,109 @@ def extract_app_files(url, timestamp):
             )
         )
 
-        run(sh.rm, tempfile_path, f=True)
+        # A pinned digest can only be checked once the whole tarball
+        # is downloaded, so download and verify it before extracting
+        if config('stream_app_tgz') and not expected_sha256:
+            opener = urlopen
+
+            if cache:
+                opener = cache.open
+
+            # Download, decompress and extract in one pass
+            try:
+                return stream_extract_url(
+                    url, install_path, strip=1,
+                    opener=opener, previous_path=previous_path
+                )
+            except Exception:
+                # Don't leave a partial release to be reused next time
+                remove_path(install_path)
+                raise
+
+        if cache:
+            tgz_path = cache.fetch(url, expected_sha256)
+        else:
+            tgz_path = '/tmp/wsgi-app-package.tgz'
+
+            remove_path(tgz_path)
 
-        urlretrieve(url, tempfile_path)
+            urlretrieve(url, tgz_path)
+
+            if expected_sha256 and file_sha256(tgz_path) != expected_sha256:
+                raise ValueError(
+                    "sha256 of {0} doesn't match app_tgz_sha256".format(url)
+                )
 
         # Extract files into install dir
-        run(
-            sh.tar,
-            file=tempfile_path,
-            directory=install_path,
-            strip="1", z=True, x=True
-        )
+        if previous_path:
+            try:
+                extract_file(tgz_path, install_path, 1, previous_path)
+            except Exception:
+                remove_path(install_path)
+                raise
+        else:
+            run(
+                sh.tar,
+                file=tgz_path,
+                directory=install_path,
+                strip="1", z=True, x=True
+            )
 
     return install_path
 
 
+def previous_release(install_path):
+    """
+    Return the live release directory to reuse unchanged files from,
+    if hardlinking is enabled and there is one
+    """
+
+    if config('hardlink_unchanged_files') and path.exists(live_link_path):
+        previous_path = path.realpath(live_link_path)
+
+        if previous_path != path.realpath(install_path):
+            return previous_path
+
+
+def artifact_cache():
+    """
+    Return the cache of downloaded app tarballs,
+    or None if it has been disabled in config
+    """
+
+    max_megabytes = config('app_tgz_cache_size')
+
+    if max_megabytes:
+        return ArtifactCache(artifact_cache_dir, max_megabytes * 1024 * 1024)
+
+
+def prepare_static_files(app_dir):
+    """
+    Write compressed variants of the app's static files
+    and fingerprinted copies of them, as enabled in config
+    Return True if this changed the environment variables
+    """
+
+    static_dir = path.join(app_dir, config('static_path'))
+    static_variables = {}
+
+    if path.isdir(static_dir):
+        if config('static_precompress'):
+            precompress(static_dir)
+
+        if config('static_fingerprint'):
+            live_static_dir = path.join(live_link_path, config('static_path'))
+            manifest_path = path.join(live_static_dir, manifest_name)
+
+            fingerprint(static_dir, manifest_path)
+
+            # Tell the app where to find the live manifest
+            static_variables['STATIC_MANIFEST_PATH'] = manifest_path
+
+    # Owned by "static", so it's removed once fingerprinting is switched off
+    return update_environment(static_variables, owner='static')
+
+
 def install_dependencies(timestamp):
     """
     Install pip and gem dependencies for the app
@@ -129,8 +551,37 @@ def install_dependencies(timestamp):
 
     app_path = path.join(install_parent, timestamp)
 
+    digest = dependencies_digest(
+        path.join(app_path, config('pip_requirements_path')),
+        path.join(app_path, config('pip_cache_path')),
+        config('pip_virtualenv'),
+        config('pip_no_index')
+    )
+
+    previous = load_record(live_link_path)
+
+    if previous and previous['digest'] == digest:
+        log(
+            "Dependencies unchanged since the live release, "
+            "skipping install (saves about {0:.1f}s)".format(
+                previous['seconds']
+            )
+        )
+
+        if config('pip_virtualenv'):
+            # Links the live release's virtualenv
+            pip_dependencies(app_path)
+
+        save_record(app_path, digest, previous['seconds'])
+
+        return
+
+    start = time()
+
     pip_dependencies(app_path)
 
+    save_record(app_path, digest, time() - start)
+
 
 def pip_dependencies(app_path):
     """
@@ -142,7 +593,20 @@ def pip_dependencies(app_path):
     requirements_path = path.join(app_path, config('pip_requirements_path'))
     dependencies_path = path.join(app_path, config('pip_cache_path'))
 
-    if path.isfile(requirements_path):
+    if config('pip_virtualenv'):
+        # Install into a virtualenv for this release
+        create_virtualenv(
+            path.join(app_path, venv_name),
+            requirements_path,
+            wheelhouse_dir,
+            find_links=dependencies_path,
+            no_index=config('pip_no_index'),
+            previous_venv=path.join(live_link_path, venv_name),
+            previous_requirements=path.join(
+                live_link_path, config('pip_requirements_path')
+            )
+        )
+    elif path.isfile(requirements_path):
         # Install from requirements file if possible
         log("Installing pip requirements from {0}".format(requirements_path))
 
@@ -156,21 +620,52 @@ def pip_dependencies(app_path):
 
 
 def setup_apache_wsgi(timestamp, app_dir):
-    run(sh.a2enmod, "ssl", "proxy_http")
+    """
+    Write the apache config for a release
+    Return True if the change needs a full apache restart
+    (because modules or MPM sizing changed)
+    """
+
+    # mod_status is read by the busy workers nagios check,
+    # and mod_setenvif keeps its requests out of the access log
+    modules = ["ssl", "proxy_http", "status", "setenvif"]
+
+    if config('static_precompress') or config('static_max_age'):
+        modules += ["rewrite", "headers", "expires"]
+
+    modules_changed = enable_modules(*modules)
 
     available_path = path.join(sites_available_dir, timestamp)
 
-    (keyfile_path, certificate_path) = copy_ssl_certificates(timestamp)
+    (keyfile_path, certificate_path) = ssl_certificate_paths(timestamp)
 
     conf_template = apache_conf_template(app_dir)
 
     wsgi_path = path.join(live_link_path, config('wsgi_file_path'))
 
+    wsgi_daemon = None
+
+    if config('wsgi_daemon_mode'):
+        wsgi_daemon = wsgi_daemon_settings(config())
+
+    mpm_changed = configure_mpm(wsgi_daemon)
+
+    wsgi_path = write_wsgi_wrapper(timestamp, app_dir, wsgi_path)
+
     conf_content = conf_template.render({
         'wsgi_path': wsgi_path,
-        'wsgi_app_name': config('wsgi_app_name'),
+        'wsgi_app_name': 'application',
         'wsgi_dir': path.dirname(wsgi_path),
         'wsgi_file': path.basename(wsgi_path),
+        'wsgi_daemon': wsgi_daemon,
+        'wsgi_preload': wsgi_daemon and config('wsgi_preload'),
+        'https_direct': config('https_serve_directly'),
+        'python_home': (
+            path.join(live_link_path, venv_name)
+            if config('pip_virtualenv') else None
+        ),
+        'static_precompressed': config('static_precompress'),
+        'static_max_age': config('static_max_age'),
         'static_url_path': config('static_url_path'),
         'static_path': path.join(live_link_path, config('static_path')),
         'keyfile_path': keyfile_path,
@@ -181,23 +676,110 @@ def setup_apache_wsgi(timestamp, app_dir):
     with open(available_path, 'w') as conf:
         conf.write(conf_content)
 
-    # Add line to bottom of envvars to source scriptrc
-    apache_env_file = path.join(apache_dir, 'envvars')
+    return modules_changed or mpm_changed
 
-    source_file_path = path.join(charm_dir, 'scripts/scriptrc')
-    source_command = '. {0}'.format(source_file_path)
 
-    comment = '# scriptrc link added by apache2-wsgi charm:'
+def write_wsgi_wrapper(timestamp, app_dir, wsgi_path):
+    """
+    Write a WSGI script beside the app's which loads the charm's
+    environment variables before the app, and optionally wraps the app in
+    the charm's profiling middleware (scripts/wsgi_profiler.py)
+    Return the path apache should serve it from
+    """
 
-    comment_exists = False
+    if config('wsgi_profiler'):
+        create_dir(profiles_dir)
+        chown(
+            profiles_dir,
+            pwd.getpwnam('www-data').pw_uid,
+            grp.getgrnam('www-data').gr_gid
+        )
 
-    with open(apache_env_file) as env_file_read:
-        comment_exists = comment in env_file_read.read()
+    wrapper_relative_path = wsgi_wrapper_path()
 
-    if not comment_exists:
-        with open(apache_env_file, 'a') as env_file:
-            env_file.write(comment + '\n')
-            env_file.write(source_command + '\n')
+    jinja_env = Environment(loader=FileSystemLoader(charm_dir))
+    template = jinja_env.get_template('templates/wsgi-wrapper.py')
+
+    with open(path.join(app_dir, wrapper_relative_path), 'w') as wrapper:
+        wrapper.write(template.render({
+            'timestamp': timestamp,
+            'wsgi_path': wsgi_path,
+            'wsgi_app_name': config('wsgi_app_name'),
+            'environment_path': environment_store_path,
+            'profiler': config('wsgi_profiler'),
+            'profiler_path': profiler_path,
+            'output_dir': profiles_dir,
+            'slow_ms': config('wsgi_profiler_slow_ms'),
+            'interval_ms': config('wsgi_profiler_interval_ms'),
+            'keep': config('wsgi_profiler_keep')
+        }))
+
+    return path.join(live_link_path, wrapper_relative_path)
+
+
+def wsgi_wrapper_path():
+    """
+    Where the WSGI wrapper script goes, relative to a release
+    """
+
+    return path.join(path.dirname(config('wsgi_file_path')), wsgi_wrapper_name)
+
+
+def enable_modules(*modules):
+    """
+    Enable apache modules
+    Return True if any weren't already enabled
+    """
+
+    enabled_before = set(listdir(mods_enabled_dir))
+
+    run(sh.a2enmod, *modules)
+
+    return set(listdir(mods_enabled_dir)) != enabled_before
+
+
+def configure_mpm(wsgi_daemon):
+    """
+    Switch to the MPM chosen in config
+    and write its sizing into a managed conf-available snippet,
+    only touching the snippet if the values have changed
+    Return True if anything changed
+    """
+
+    mpm = config('apache_mpm')
+
+    if not mpm:
+        return False
+
+    enabled_before = set(listdir(mods_enabled_dir))
+
+    other_mpms = [module for module in mpm_modules if module != mpm]
+    run(sh.a2dismod, *other_mpms)
+    run(sh.a2enmod, mpm)
+
+    mpm_changed = set(listdir(mods_enabled_dir)) != enabled_before
+
+    jinja_env = Environment(loader=FileSystemLoader(charm_dir))
+    template = jinja_env.get_template('templates/mpm.conf')
+    conf_content = template.render(mpm_settings(config(), wsgi_daemon))
+
+    existing_content = None
+
+    if path.isfile(mpm_conf_path):
+        with open(mpm_conf_path) as conf:
+            existing_content = conf.read()
+
+    if conf_content != existing_content:
+        log('Writing MPM settings to {0}'.format(mpm_conf_path))
+
+        with open(mpm_conf_path, 'w') as conf:
+            conf.write(conf_content)
+
+        run(sh.a2enconf, mpm_conf_name)
+
+        mpm_changed = True
+
+    return mpm_changed
 
 
 def apache_conf_template(app_dir):
@@ -219,15 +801,23 @@ def apache_conf_template(app_dir):
     return template
 
 
-def copy_ssl_certificates(timestamp):
+def release_config_paths(timestamp):
     """
-    Copy either the default self-signed certificate
-    or the provided custom ones
-    into /etc/ssl/certs/wsgi-app.*
-    Return the locations of the created files
+    The files the ssl and vhost stages write for a release
+    """
+
+    return [
+        path.join(sites_available_dir, timestamp),
+        mpm_conf_path,
+        path.join(install_parent, timestamp, wsgi_wrapper_path())
+    ] + list(ssl_certificate_paths(timestamp))
+
+
+def ssl_certificate_paths(timestamp):
+    """
+    The locations of a release's keyfile and certificate
     """
 
-    certs_dir = '/etc/ssl/certs'
     keyfile_path = path.join(
         certs_dir,
         'wsgi-app.{0}.key'.format(timestamp)
@@ -237,6 +827,19 @@ def copy_ssl_certificates(timestamp):
         'wsgi-app.{0}.crt'.format(timestamp)
     )
 
+    return (keyfile_path, certificate_path)
+
+
+def copy_ssl_certificates(timestamp):
+    """
+    Copy either the default self-signed certificate
+    or the provided custom ones
+    into /etc/ssl/certs/wsgi-app.*
+    Return the locations of the created files
+    """
+
+    (keyfile_path, certificate_path) = ssl_certificate_paths(timestamp)
+
     custom_keyfile = config('ssl_keyfile')
     custom_certificate = config('ssl_certificate')
 
@@ -266,13 +869,24 @@ def copy_ssl_certificates(timestamp):
     return (keyfile_path, certificate_path)
 
 
-def set_current(timestamp):
+def set_current(timestamp, full_restart=False, replaced=None):
     """
     Set an app directory to the currently live app
     by creating a symlink as specified in config
+    then reload apache (see `reload_apache`).
+    If apache's config doesn't pass its check with the new links,
+    put the previous links back before failing, along with the files
+    in `replaced` (from `snapshot_paths`), if the release's config was
+    rewritten in place, so a later restart still finds a working config
     """
 
     app_path = path.join(install_parent, timestamp)
+    site_to_enable = path.join(sites_available_dir, timestamp)
+
+    previous_targets = dict(
+        (link_path, readlink(link_path) if path.islink(link_path) else None)
+        for link_path in (live_link_path, sites_enabled_path)
+    )
 
     log(
         "Linking live path '{live}' to app dir: {app_dir}".format(
@@ -280,21 +894,119 @@ def set_current(timestamp):
         )
     )
 
-    run(sh.rm, live_link_path, force=True)
-    run(sh.ln, app_path, live_link_path, symbolic=True)
+    atomic_symlink(app_path, live_link_path)
 
-    site_to_enable = path.join(sites_available_dir, timestamp)
+    # Swap our link in sites-enabled over to the new site
+    atomic_symlink(site_to_enable, sites_enabled_path)
+
+    try:
+        check_apache_config()
+    except Exception:
+        log('Apache config check failed, restoring the previous links',
+            'ERROR')
+        restore_links(previous_targets)
+
+        if replaced:
+            log('Restoring the previous apache config files', 'ERROR')
+            restore_paths(replaced)
+
+        raise
+
+    # Delete any other site links
+    for site_link in listdir(sites_enabled_dir):
+        site_link_path = path.join(sites_enabled_dir, site_link)
+
+        if site_link_path != sites_enabled_path:
+            log('Removing {0}'.format(site_link_path))
+            remove(site_link_path)
 
-    site_links = sh.glob(path.join(sites_enabled_dir, '*'))
+    # Reload apache
+    reload_apache(full_restart, config_checked=True)
 
-    # Delete existing site links
-    run(sh.rm, site_links, f=True)
+    warm_up_app()
 
-    # Add our link into sites-enabled
-    run(sh.ln, site_to_enable, sites_enabled_path, s=True)
 
-    # Restart apache
-    restart()
+def restore_links(targets):
+    """
+    Point each link back at its previous target,
+    or remove it if it didn't exist before
+    """
+
+    for (link_path, target) in targets.items():
+        if target:
+            atomic_symlink(target, link_path)
+        elif path.islink(link_path):
+            log('Removing {0}'.format(link_path))
+            remove(link_path)
+
+
+def warm_up_app():
+    """
+    Request the warm-up URLs from config from the local server,
+    as many times at once as there are mod_wsgi daemon processes.
+    This is best effort: mod_wsgi doesn't promise to spread the requests
+    one per process, and after a graceful reload some may still be served
+    by old processes. `wsgi_preload` is what loads every process
+    """
+
+    paths = (config('warmup_urls') or '').split()
+
+    if paths:
+        processes = 1
+
+        if config('wsgi_daemon_mode'):
+            processes = wsgi_daemon_settings(config())['processes']
+
+        urls = ['http://localhost' + url_path for url_path in paths]
+
+        warm_up(urls, repeat=processes)
+
+
+def remove_old_releases(timestamp):
+    """
+    Delete releases outside the retention policy in config,
+    along with their apache configs and certificates
+    """
+
+    keep = config('keep_releases')
+    keep_days = config('keep_releases_days')
+
+    if keep or keep_days:
+        collect_garbage(
+            install_parent, live_link_path, sites_available_dir, certs_dir,
+            keep, keep_days, protected=[timestamp]
+        )
+
+
+def check_apache_config():
+    """
+    Make sure apache's config is valid before reloading or restarting,
+    so a broken config fails the hook rather than taking apache down
+    """
+
+    log('Checking apache config')
+    run(sh.apache2ctl, "configtest")
+
+
+def reload_apache(full_restart=False, config_checked=False):
+    """
+    Gracefully reload apache, letting in-flight requests finish,
+    falling back to a restart if the reload fails
+    Do a full restart instead if `full_restart` is set
+    (needed for new modules or environment variables)
+    or if `graceful_reload` is disabled in config.
+    The config is checked first, unless `config_checked` says
+    the caller has just done so
+    """
+
+    if not config_checked:
+        check_apache_config()
+
+    if full_restart or not config('graceful_reload'):
+        restart()
+    else:
+        service_reload("apache2", restart_on_failure=True)
+        log('Reloaded apache')
 
 
 def restart():
@@ -311,9 +1023,132 @@ def setup_http_server():
 
     log('setting up "http-server" with address "{0}"'.format(public_address))
 
-    sh.relation_set('hostname={0}'.format(public_address))
+    settings = ['hostname={0}'.format(public_address)]
+
+    # Let the other side see how busy this unit is, and its capacity
+    status = server_status_summary()
+
+    if max_request_workers():
+        status['max_workers'] = max_request_workers()
+
+    for (key, value) in sorted(status.items()):
+        settings.append('{0}={1}'.format(key, value))
+
+    sh.relation_set(*settings)
+
+    reload_apache()
+
+
+def update_nrpe_config():
+    """
+    Install the charm's nagios plugin and write NRPE checks for
+    the app's response time, p99 latency, request queue and apache workers
+    """
+
+    log('Installing {0}'.format(nagios_plugin_path))
+    create_dir(path.dirname(nagios_plugin_path))
+    copy(nagios_plugin_source, nagios_plugin_path)
+    chmod(nagios_plugin_path, 0755)
+
+    for stale_path in stale_nrpe_configs:
+        if path.isfile(stale_path):
+            remove(stale_path)
+
+    site_name = sh.unit_get('public-address').rstrip()
+
+    check_http_command = (
+        "check_http -H {host} -I 127.0.0.1 -p 80 -u '{uri}' -e 200 "
+        "-w {warning} -c {critical}"
+    ).format(
+        host=site_name,
+        uri=config('nagios_check_uri'),
+        warning=config('nagios_response_warning'),
+        critical=config('nagios_response_critical')
+    )
+
+    if config('nagios_check_string'):
+        check_http_command += " -s '{0}'".format(config('nagios_check_string'))
+
+    # Keep the host names and service groups the bash hook used
+    nrpe = NRPE(nagios_context='isd-' + config('nagios_environment'))
+
+    nrpe.add_check(
+        'wsgi_server',
+        'apache2-wsgi http check',
+        check_http_command
+    )
+    nrpe.add_check(
+        'wsgi_latency',
+        'apache2-wsgi p99 latency',
+        'check_wsgi_app latency {0} {1}'.format(
+            config('nagios_p99_warning'), config('nagios_p99_critical')
+        )
+    )
+
+    if config('wsgi_daemon_mode'):
+        nrpe.add_check(
+            'wsgi_queue',
+            'apache2-wsgi mod_wsgi request queue',
+            'check_wsgi_app queue {0} {1}'.format(
+                config('nagios_queue_warning'),
+                config('nagios_queue_critical')
+            )
+        )
+    else:
+        # There are no daemon sockets to check any more
+        nrpe.remove_check('wsgi_queue')
+
+    nrpe.add_check(
+        'wsgi_workers',
+        'apache2-wsgi busy apache workers',
+        'check_wsgi_app workers {0} {1} {2}'.format(
+            config('nagios_workers_warning'),
+            config('nagios_workers_critical'),
+            max_request_workers() or ''
+        ).rstrip()
+    )
+
+    nrpe.write()
+
+
+def max_request_workers():
+    """
+    The MaxRequestWorkers the charm gives the MPM,
+    or None if it leaves apache's default
+    """
+
+    if not config('apache_mpm'):
+        return None
+
+    wsgi_daemon = None
+
+    if config('wsgi_daemon_mode'):
+        wsgi_daemon = wsgi_daemon_settings(config())
+
+    return mpm_settings(config(), wsgi_daemon)['max_request_workers']
+
+
+def server_status_summary():
+    """
+    The latest worker figures from the server status collector,
+    or nothing if it hasn't run yet
+    """
+
+    if not path.isfile(server_status_summary_path):
+        return {}
+
+    with open(server_status_summary_path) as summary_file:
+        try:
+            summary = json.load(summary_file)['summary'] or {}
+        except (ValueError, KeyError):
+            return {}
 
-    restart()
+    return dict(
+        (key, summary[key]) for key in (
+            'busy_workers', 'idle_workers', 'requests_per_second'
+        )
+        if summary.get(key) is not None
+    )
 
 
 def store_relation_hostname_in_env(environment_variable_name):
@@ -321,28 +1156,50 @@ def store_relation_hostname_in_env(environment_variable_name):
     relation_hostname = sh.relation_get('hostname').rstrip()
 
     # Save it as an environment variable
-    save_environment_variable(environment_variable_name, relation_hostname)
-
-    restart()
+    if save_environment_variable(environment_variable_name, relation_hostname):
+        reload_environment()
 
 
 def save_environment_variable(name, value):
-    variables_string = '{name}={value}'.format(name=name, value=value)
+    """
+    Set one environment variable for the app
+    Return True if it changed
+    """
 
-    save_environment_variables_string(variables_string)
+    return update_environment({name: value})
 
 
 def save_environment_variables_string(env_vars):
-    log('setting environment variable: {0}'.format(env_vars))
+    """
+    Set the app's environment variables from config, like `A=1 B=2`,
+    removing any that config set before but no longer does
+    Return True if the environment changed
+    """
 
-    export_string = 'export {0}\n'.format(env_vars)
+    return update_environment(parse_variables(env_vars), owner='config')
 
-    already_set = False
 
-    with open(scriptrc_path) as scriptrc_read:
-        already_set = export_string in scriptrc_read.read()
+def update_environment(variables, owner=None):
+    """
+    Save environment variables in the store the WSGI wrapper reads
+    """
 
-    # Save into scripts/scriptrc
-    if not already_set:
-        with open(scriptrc_path, 'a') as scriptrc:
-            scriptrc.write(export_string)
+    group = grp.getgrnam('www-data').gr_gid
+
+    return set_variables(environment_store_path, variables, owner, group)
+
+
+def reload_environment():
+    """
+    Make the app re-read its environment.
+    In daemon mode, touching the WSGI script makes mod_wsgi restart
+    just the daemon processes, otherwise gracefully reload apache
+    """
+
+    wrapper_path = path.join(live_link_path, wsgi_wrapper_path())
+
+    if config('wsgi_daemon_mode') and path.isfile(wrapper_path):
+        log('Touching {0} to restart the WSGI processes'.format(wrapper_path))
+        utime(wrapper_path, None)
+    else:
+        reload_apache()
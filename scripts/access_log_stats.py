@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+
+"""
+Summarise the app's access log into request latency, status and bandwidth
+statistics, for Nagios checks and metrics scrapers to read cheaply.
+
+Usage: access_log_stats.py [LOG_PATH] [OUTPUT_DIR]
+
+Each run reads only what has been appended to the log since the last run,
+following it across logrotate's rename, and writes:
+
+    OUTPUT_DIR/access-log-stats.json  Latency percentiles (p50/p95/p99),
+                                      status counts and bytes served,
+                                      per URL prefix, over the last
+                                      `window_minutes`
+    OUTPUT_DIR/access-log-stats.prom  Running totals as Prometheus
+                                      histograms and counters, for
+                                      node_exporter's textfile collector
+
+The charm runs it from cron every minute.
+Lines are counted against the minute in which they were read,
+rather than parsing each line's timestamp.
+Lines which can't be parsed are counted, as `unparsed_lines`
+and wsgi_app_unparsed_lines_total, rather than silently skipped.
+"""
+
+import json
+import os
+import re
+import sys
+from array import array
+from time import time
+
+
+default_log_path = '/var/log/apache2/wsgi-app-access.log'
+default_output_dir = '/var/lib/wsgi-app'
+
+state_name = 'access-log-state.json'
+json_name = 'access-log-stats.json'
+prometheus_name = 'access-log-stats.prom'
+
+# How many minutes of traffic the percentiles cover
+window_minutes = 5
+
+# Read at most this much per run, so a large backlog is caught up on
+# over several runs rather than read into memory at once
+max_read_bytes = 64 * 1024 * 1024
+
+# Group requests by their first directory (/api, /static ...),
+# with top-level pages under /,
+# and lump everything past this many prefixes together
+max_prefixes = 50
+other_prefix = 'other'
+
+# Upper bounds of the latency buckets, in milliseconds,
+# each 25% wider than the last, from 1ms to about a minute
+bucket_bounds = [round(1.25 ** power, 1) for power in range(50)]
+
+# The `combined_with_request_time` format in templates/wsgi-app.conf:
+# %h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i" %D
+# Apache escapes quotes within the request line as \"
+line_pattern = re.compile(
+    r'^\S+ \S+ \S+ \[[^\]]*\] "(?P<request>(?:[^"\\]|\\.)*)" '
+    r'(?P<status>\d{3}) (?P<bytes>\d+|-) ".*" (?P<microseconds>\d+)$'
+)
+request_pattern = re.compile(r'^\S+ (?P<path>[^ ?]*)')
+
+
+class Stats(object):
+    """
+    Request counts for one URL prefix:
+    latency bucket counts (plus the total milliseconds),
+    and requests and bytes per status code
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+
+        self.buckets = array('L', data.get('buckets') or [0] * (
+            len(bucket_bounds) + 1
+        ))
+        self.milliseconds = data.get('milliseconds', 0.0)
+        self.statuses = data.get('statuses', {})
+        self.bytes = data.get('bytes', 0)
+
+    def add(self, milliseconds, status, size):
+        index = bucket_index(milliseconds)
+        self.buckets[index] += 1
+        self.milliseconds += milliseconds
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += size
+
+    def merge(self, other):
+        for (index, count) in enumerate(other.buckets):
+            self.buckets[index] += count
+
+        self.milliseconds += other.milliseconds
+        self.bytes += other.bytes
+
+        for (status, count) in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def percentile(self, fraction):
+        """
+        Estimate a latency percentile, in milliseconds,
+        by interpolating within the bucket it falls in
+        """
+
+        target = self.count * fraction
+        seen = 0
+
+        for (index, count) in enumerate(self.buckets):
+            if count and seen + count >= target:
+                lower = bucket_bounds[index - 1] if index else 0.0
+                upper = (
+                    bucket_bounds[index] if index < len(bucket_bounds)
+                    else bucket_bounds[-1] * 2
+                )
+
+                return lower + (upper - lower) * (target - seen) / count
+
+            seen += count
+
+        return 0.0
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.buckets),
+            'milliseconds': self.milliseconds,
+            'statuses': self.statuses,
+            'bytes': self.bytes
+        }
+
+
+def bucket_index(milliseconds):
+    """
+    Binary search for the first bucket the latency fits in
+    """
+
+    (low, high) = (0, len(bucket_bounds))
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if milliseconds <= bucket_bounds[middle]:
+            high = middle
+        else:
+            low = middle + 1
+
+    return low
+
+
+def url_prefix(url_path):
+    segments = (url_path or '/').split('/')
+
+    if len(segments) > 2:
+        return '/' + segments[1]
+
+    return '/'
+
+
+def load_state(state_path):
+    if os.path.isfile(state_path):
+        with open(state_path) as state_file:
+            try:
+                return json.load(state_file)
+            except ValueError:
+                pass
+
+    return {
+        'inode': None, 'offset': 0, 'totals': {}, 'minutes': {}, 'unparsed': 0
+    }
+
+
+def save_state(state_path, state):
+    write_atomically(state_path, json.dumps(state))
+
+
+def write_atomically(file_path, content):
+    """
+    Write a file under a temporary name, then rename it into place,
+    so readers never see it half-written
+    """
+
+    temp_path = '{0}.tmp-{1}'.format(file_path, os.getpid())
+
+    with open(temp_path, 'w') as output:
+        output.write(content)
+
+    os.rename(temp_path, file_path)
+
+
+def new_lines(log_path, inode, offset):
+    """
+    Read complete lines appended since `offset`.
+    If the log has been rotated, finish reading the old file first,
+    if logrotate has left it uncompressed as LOG_PATH.1
+    Return the lines, and the inode and offset to start from next time
+    """
+
+    lines = []
+
+    if not os.path.isfile(log_path):
+        return (lines, inode, offset)
+
+    stats = os.stat(log_path)
+
+    if inode is not None and stats.st_ino != inode:
+        rotated_path = log_path + '.1'
+
+        if (
+            os.path.isfile(rotated_path) and
+            os.stat(rotated_path).st_ino == inode
+        ):
+            (rotated_lines, ignored_offset) = read_from(rotated_path, offset)
+            lines.extend(rotated_lines)
+
+        offset = 0
+    elif stats.st_size < offset:
+        # Truncated in place
+        offset = 0
+
+    (current_lines, offset) = read_from(log_path, offset)
+    lines.extend(current_lines)
+
+    return (lines, stats.st_ino, offset)
+
+
+def read_from(file_path, offset):
+    with open(file_path, 'rb') as log_file:
+        log_file.seek(offset)
+        content = log_file.read(max_read_bytes)
+
+    # Leave any partly-written last line for next time
+    end = content.rfind('\n') + 1
+
+    return (content[:end].splitlines(), offset + end)
+
+
+def parse(lines):
+    """
+    Count the requests in some log lines by URL prefix
+    Return the counts and the number of lines which couldn't be parsed
+    """
+
+    stats = {}
+    unparsed = 0
+
+    for line in lines:
+        match = line_pattern.match(line)
+
+        if not match:
+            unparsed += 1
+            continue
+
+        request = request_pattern.match(match.group('request'))
+        prefix = url_prefix(request.group('path') if request else None)
+
+        if prefix not in stats:
+            stats[prefix] = Stats()
+
+        size = match.group('bytes')
+
+        stats[prefix].add(
+            int(match.group('microseconds')) / 1000.0,
+            match.group('status'),
+            int(size) if size != '-' else 0
+        )
+
+    return (stats, unparsed)
+
+
+def add_stats(stored, new_stats):
+    """
+    Merge new counts into one minute's per-prefix counts,
+    then fold the least busy prefixes into `other_prefix`
+    once there are too many
+    """
+
+    for (prefix, stats) in new_stats.items():
+        merge_into(stored, prefix, stats)
+
+    named = [prefix for prefix in stored if prefix != other_prefix]
+
+    if len(named) <= max_prefixes:
+        return
+
+    def busyness(prefix):
+        return sum(stored[prefix]['buckets'])
+
+    other = Stats(stored.get(other_prefix))
+
+    for prefix in sorted(named, key=busyness, reverse=True)[max_prefixes:]:
+        other.merge(Stats(stored.pop(prefix)))
+
+    stored[other_prefix] = other.to_dict()
+
+
+def add_totals(totals, new_stats, recent):
+    """
+    Add new counts to the running totals, which are exported as
+    Prometheus counters, so every prefix's totals only ever grow.
+    Only the `max_prefixes` busiest prefixes are tracked, ranked by their
+    requests in `recent` (request counts by prefix) and then by their totals.
+    A prefix which drops out, like a scanner's once it's quiet,
+    loses its totals rather than having them moved into `other_prefix`,
+    which Prometheus sees as the series going away.
+    Requests for prefixes which aren't tracked are counted under
+    `other_prefix`
+    """
+
+    def busyness(prefix):
+        return (
+            recent.get(prefix, 0),
+            prefix in totals,
+            sum(totals[prefix]['buckets']) if prefix in totals else 0
+        )
+
+    candidates = (set(totals) | set(new_stats)) - set([other_prefix])
+    tracked = set(
+        sorted(candidates, key=busyness, reverse=True)[:max_prefixes]
+    )
+
+    for prefix in list(totals):
+        if prefix != other_prefix and prefix not in tracked:
+            del totals[prefix]
+
+    for (prefix, stats) in new_stats.items():
+        merge_into(
+            totals, prefix if prefix in tracked else other_prefix, stats
+        )
+
+
+def merge_into(stored, prefix, stats):
+    merged = Stats(stored.get(prefix))
+    merged.merge(stats)
+    stored[prefix] = merged.to_dict()
+
+
+def window_summary(minutes):
+    """
+    Combine the per-minute counts into percentiles and totals per prefix
+    """
+
+    window = {}
+
+    for counts in minutes.values():
+        for (prefix, data) in counts.items():
+            window.setdefault(prefix, Stats()).merge(Stats(data))
+
+    summary = {}
+
+    for (prefix, stats) in sorted(window.items()):
+        summary[prefix] = {
+            'requests': stats.count,
+            'p50_ms': round(stats.percentile(0.5), 1),
+            'p95_ms': round(stats.percentile(0.95), 1),
+            'p99_ms': round(stats.percentile(0.99), 1),
+            'statuses': stats.statuses,
+            'bytes': stats.bytes
+        }
+
+    return summary
+
+
+def label_value(value):
+    """
+    Escape a label value as the Prometheus text format requires
+    """
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n'
+    )
+
+
+def prometheus_text(totals, summary, unparsed=0):
+    lines = [
+        '# HELP wsgi_app_request_duration_seconds '
+        'Request latency, from the access log',
+        '# TYPE wsgi_app_request_duration_seconds histogram'
+    ]
+
+    for (prefix, data) in sorted(totals.items()):
+        stats = Stats(data)
+        cumulative = 0
+
+        for (index, count) in enumerate(stats.buckets):
+            cumulative += count
+            bound = (
+                repr(bucket_bounds[index] / 1000.0)
+                if index < len(bucket_bounds) else '+Inf'
+            )
+            lines.append(
+                'wsgi_app_request_duration_seconds_bucket'
+                '{{prefix="{0}",le="{1}"}} {2}'.format(
+                    label_value(prefix), bound, cumulative
+                )
+            )
+
+        lines.append(
+            'wsgi_app_request_duration_seconds_sum'
+            '{{prefix="{0}"}} {1}'.format(
+                label_value(prefix), stats.milliseconds / 1000.0
+            )
+        )
+        lines.append(
+            'wsgi_app_request_duration_seconds_count'
+            '{{prefix="{0}"}} {1}'.format(label_value(prefix), cumulative)
+        )
+
+    lines.extend([
+        '# HELP wsgi_app_requests_total Requests, by status code',
+        '# TYPE wsgi_app_requests_total counter'
+    ])
+
+    for (prefix, data) in sorted(totals.items()):
+        for (status, count) in sorted(data['statuses'].items()):
+            lines.append(
+                'wsgi_app_requests_total'
+                '{{prefix="{0}",status="{1}"}} {2}'.format(
+                    label_value(prefix), status, count
+                )
+            )
+
+    lines.extend([
+        '# HELP wsgi_app_response_bytes_total Bytes served',
+        '# TYPE wsgi_app_response_bytes_total counter'
+    ])
+
+    for (prefix, data) in sorted(totals.items()):
+        lines.append(
+            'wsgi_app_response_bytes_total{{prefix="{0}"}} {1}'.format(
+                label_value(prefix), data['bytes']
+            )
+        )
+
+    lines.extend([
+        '# HELP wsgi_app_request_duration_window_seconds '
+        'Latency percentiles over the last {0} minutes'.format(
+            window_minutes
+        ),
+        '# TYPE wsgi_app_request_duration_window_seconds gauge'
+    ])
+
+    for (prefix, window) in sorted(summary.items()):
+        for quantile in ('p50', 'p95', 'p99'):
+            lines.append(
+                'wsgi_app_request_duration_window_seconds'
+                '{{prefix="{0}",quantile="0.{1}"}} {2}'.format(
+                    label_value(prefix),
+                    quantile[1:],
+                    window[quantile + '_ms'] / 1000.0
+                )
+            )
+
+    lines.extend([
+        '# HELP wsgi_app_unparsed_lines_total '
+        'Access log lines which could not be parsed',
+        '# TYPE wsgi_app_unparsed_lines_total counter',
+        'wsgi_app_unparsed_lines_total {0}'.format(unparsed)
+    ])
+
+    return '\n'.join(lines) + '\n'
+
+
+def update(log_path=default_log_path, output_dir=default_output_dir):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    state_path = os.path.join(output_dir, state_name)
+    state = load_state(state_path)
+    now = time()
+    minute = str(int(now // 60) * 60)
+
+    (lines, state['inode'], state['offset']) = new_lines(
+        log_path, state['inode'], state['offset']
+    )
+
+    (new_stats, unparsed) = parse(lines)
+    state['unparsed'] = state.get('unparsed', 0) + unparsed
+
+    add_stats(state['minutes'].setdefault(minute, {}), new_stats)
+
+    # Forget minutes that have left the window
+    for old_minute in list(state['minutes']):
+        if int(old_minute) <= now - window_minutes * 60:
+            del state['minutes'][old_minute]
+
+    summary = window_summary(state['minutes'])
+
+    # Rank prefixes for the running totals by how busy they are now
+    recent = dict(
+        (prefix, window['requests']) for (prefix, window) in summary.items()
+    )
+
+    add_totals(state['totals'], new_stats, recent)
+
+    write_atomically(
+        os.path.join(output_dir, json_name),
+        json.dumps(
+            {
+                'updated': int(now),
+                'window_minutes': window_minutes,
+                'prefixes': summary,
+                'unparsed_lines': state['unparsed']
+            },
+            indent=2,
+            sort_keys=True
+        )
+    )
+    write_atomically(
+        os.path.join(output_dir, prometheus_name),
+        prometheus_text(state['totals'], summary, state['unparsed'])
+    )
+
+    # Only move the offset on once the output is written
+    save_state(state_path, state)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print __doc__
+        sys.exit(0)
+
+    update(
+        sys.argv[1] if len(sys.argv) > 1 else default_log_path,
+        sys.argv[2] if len(sys.argv) > 2 else default_output_dir
+    )
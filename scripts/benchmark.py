@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Measure requests per second against a URL, from a pool of threads
+each making requests over keep-alive connections.
+
+Usage: benchmark.py URL [CONCURRENCY] [SECONDS]
+
+E.g. to compare HTTPS proxied to port 80 against HTTPS served directly:
+
+    juju set apache2-wsgi https_serve_directly=false
+    ./benchmark.py https://10.0.3.5/ 20 30
+    juju set apache2-wsgi https_serve_directly=true
+    ./benchmark.py https://10.0.3.5/ 20 30
+"""
+
+import ssl
+import sys
+from httplib import HTTPConnection, HTTPSConnection
+from threading import Thread
+from time import time
+from urlparse import urlparse
+
+
+def connect(url):
+    if url.scheme != 'https':
+        return HTTPConnection(url.netloc)
+
+    # The charm's default certificate is self-signed, so don't verify it
+    if hasattr(ssl, '_create_unverified_context'):
+        return HTTPSConnection(
+            url.netloc, context=ssl._create_unverified_context()
+        )
+
+    return HTTPSConnection(url.netloc)
+
+
+def worker(url, deadline, results):
+    connection = connect(url)
+    path = url.path or '/'
+
+    while time() < deadline:
+        start = time()
+
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            results.append((response.status, time() - start))
+        except Exception:
+            results.append((None, time() - start))
+            connection.close()
+            connection = connect(url)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def benchmark(url, concurrency=10, seconds=10):
+    url = urlparse(url)
+    deadline = time() + seconds
+    results = []
+
+    threads = [
+        Thread(target=worker, args=(url, deadline, results))
+        for thread_number in range(concurrency)
+    ]
+
+    start = time()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time() - start
+    latencies = sorted(latency for (status, latency) in results)
+    failures = len([status for (status, latency) in results if status != 200])
+
+    print "Requests:       {0}".format(len(results))
+    print "Failures:       {0}".format(failures)
+    print "Requests/sec:   {0:.1f}".format(len(results) / elapsed)
+
+    if latencies:
+        print "Latency p50:    {0:.1f} ms".format(
+            percentile(latencies, 0.5) * 1000
+        )
+        print "Latency p99:    {0:.1f} ms".format(
+            percentile(latencies, 0.99) * 1000
+        )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+
+    benchmark(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    )
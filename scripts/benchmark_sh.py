@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+Measure the overhead sh.py adds to a command's I/O,
+by piping data through `sh.cat` and counting what comes out.
+
+Usage: benchmark_sh.py [MEGABYTES] [CHUNK_KILOBYTES]
+
+Reports throughput and the CPU time spent in this process
+(on sh.py's threads), rather than in cat itself.
+Run it before and after changing hooks/lib/sh.py to compare.
+"""
+
+import os
+import sys
+from time import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../hooks/lib')
+)
+
+import sh
+
+
+def pipe_through_cat(megabytes, chunk_kilobytes, tty_out):
+    chunk = '\0' * (chunk_kilobytes * 1024)
+    chunk_count = megabytes * 1024 / chunk_kilobytes
+    received = [0]
+
+    def chunks():
+        for chunk_number in xrange(chunk_count):
+            yield chunk
+
+    def count(data):
+        received[0] += len(data)
+
+    start_times = os.times()
+    start = time()
+
+    sh.cat(
+        _in=chunks(),
+        _in_bufsize=len(chunk),
+        _out=count,
+        _out_bufsize=len(chunk),
+        _tty_out=tty_out
+    ).wait()
+
+    elapsed = time() - start
+    end_times = os.times()
+    cpu = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+
+    print "Output to a {0}:".format('TTY' if tty_out else 'pipe')
+    print "    Piped:          {0:.0f} MB".format(received[0] / 1048576.0)
+    print "    Elapsed:        {0:.2f}s".format(elapsed)
+    print "    Throughput:     {0:.1f} MB/s".format(
+        received[0] / 1048576.0 / elapsed
+    )
+    print "    sh.py CPU time: {0:.2f}s".format(cpu)
+
+
+def benchmark(megabytes=1024, chunk_kilobytes=64):
+    # sh.py gives commands a TTY for stdout by default
+    pipe_through_cat(megabytes, chunk_kilobytes, tty_out=True)
+    pipe_through_cat(megabytes, chunk_kilobytes, tty_out=False)
+
+    # And the cost of starting and waiting on a trivial command
+    start = time()
+
+    for run_number in range(100):
+        sh.true()
+
+    print "sh.true():          {0:.1f} ms per call".format(
+        (time() - start) * 10
+    )
+
+
+if __name__ == '__main__':
+    benchmark(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1024,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    )
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+Nagios checks for the app's latency, request queue and apache workers.
+
+Usage: check_wsgi_app.py latency WARN_MS CRIT_MS [STATS_PATH] [MAX_AGE]
+       check_wsgi_app.py queue WARN CRIT
+       check_wsgi_app.py workers WARN_PERCENT CRIT_PERCENT [MAX_WORKERS]
+
+latency:  p99 latency over the recent window, from the summary written
+          by access_log_stats.py. UNKNOWN if the summary is older than
+          MAX_AGE seconds (default 300)
+queue:    Connections waiting on mod_wsgi's daemon sockets,
+          from the sockets' listen queues
+workers:  Busy apache workers, averaged over the last minute by
+          server_status_collector.py, as a percentage of MAX_WORKERS
+          (MaxRequestWorkers), or of all scoreboard slots.
+          Reads mod_status directly if the collector's summary is stale
+
+The charm installs this into /usr/local/lib/nagios/plugins as check_wsgi_app
+"""
+
+import json
+import os
+import sys
+from subprocess import check_output
+from time import time
+from urllib2 import urlopen
+
+
+OK = 0
+WARNING = 1
+CRITICAL = 2
+UNKNOWN = 3
+
+status_names = ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN']
+
+default_stats_path = '/var/lib/wsgi-app/access-log-stats.json'
+server_status_path = '/var/lib/wsgi-app/server-status.json'
+server_status_url = 'http://localhost/server-status?auto'
+
+
+def threshold_status(value, warning, critical):
+    if value >= critical:
+        return CRITICAL
+
+    if value >= warning:
+        return WARNING
+
+    return OK
+
+
+def check_latency(warning, critical, stats_path=default_stats_path,
+                  max_age=300):
+    if not os.path.isfile(stats_path):
+        return (UNKNOWN, 'No access log summary at {0}'.format(stats_path))
+
+    with open(stats_path) as stats_file:
+        stats = json.load(stats_file)
+
+    age = time() - stats['updated']
+
+    if age > float(max_age):
+        return (
+            UNKNOWN,
+            'Access log summary is {0:.0f}s old'.format(age)
+        )
+
+    prefixes = stats['prefixes']
+
+    if not prefixes:
+        return (OK, 'No requests in the last {0} minutes'.format(
+            stats['window_minutes']
+        ))
+
+    (slowest, slowest_stats) = max(
+        prefixes.items(), key=lambda item: item[1]['p99_ms']
+    )
+    p99 = slowest_stats['p99_ms']
+
+    perfdata = ' '.join(
+        "'p99 {0}'={1}ms;{2};{3}".format(
+            prefix, prefix_stats['p99_ms'], warning, critical
+        )
+        for (prefix, prefix_stats) in sorted(prefixes.items())
+    )
+
+    return (
+        threshold_status(p99, float(warning), float(critical)),
+        'p99 latency {0:.0f}ms for {1} | {2}'.format(p99, slowest, perfdata)
+    )
+
+
+def check_queue(warning, critical):
+    """
+    The Recv-Q of a listening unix socket is the number of connections
+    waiting to be accepted, which for mod_wsgi's daemon sockets is
+    the number of requests waiting for a free daemon thread
+    """
+
+    output = check_output(['ss', '-x', '-l', '-n'])
+    depth = 0
+    sockets = 0
+
+    for line in output.splitlines()[1:]:
+        fields = line.split()
+
+        if len(fields) > 4 and '/wsgi.' in fields[4]:
+            depth += int(fields[2])
+            sockets += 1
+
+    if not sockets:
+        return (UNKNOWN, 'No mod_wsgi daemon sockets found')
+
+    return (
+        threshold_status(depth, int(warning), int(critical)),
+        '{0} requests queued for mod_wsgi | queued={0};{1};{2};0'.format(
+            depth, warning, critical
+        )
+    )
+
+
+def collected_workers(max_age=120):
+    """
+    Average busy workers and scoreboard size from the collector's summary,
+    or None if it's missing or stale
+    """
+
+    if not os.path.isfile(server_status_path):
+        return None
+
+    with open(server_status_path) as status_file:
+        summary = json.load(status_file).get('summary')
+
+    if not summary or time() - summary['updated'] > max_age:
+        return None
+
+    return (summary['average_busy_workers'], summary['scoreboard_slots'])
+
+
+def live_workers():
+    server_status = {}
+
+    for line in urlopen(server_status_url, timeout=10).read().splitlines():
+        if ':' in line:
+            (key, value) = line.split(':', 1)
+            server_status[key.strip()] = value.strip()
+
+    return (
+        int(server_status['BusyWorkers']), len(server_status['Scoreboard'])
+    )
+
+
+def check_workers(warning, critical, max_workers=None):
+    (busy, slots) = collected_workers() or live_workers()
+    capacity = int(max_workers or 0) or slots
+    percent = 100.0 * busy / capacity
+
+    return (
+        threshold_status(percent, float(warning), float(critical)),
+        '{0:g} of {1} workers busy ({2:.0f}%) | busy={0:g};;;0;{1}'.format(
+            busy, capacity, percent
+        )
+    )
+
+
+checks = {
+    'latency': check_latency,
+    'queue': check_queue,
+    'workers': check_workers
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] not in checks:
+        print __doc__
+        sys.exit(UNKNOWN)
+
+    try:
+        (status, message) = checks[sys.argv[1]](*sys.argv[2:])
+    except Exception as error:
+        (status, message) = (UNKNOWN, str(error))
+
+    print '{0} - {1}'.format(status_names[status], message)
+    sys.exit(status)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+Sample apache's mod_status at a fixed interval, to show how close
+the server is to running out of workers.
+
+Usage: server_status_collector.py [SECONDS] [INTERVAL] [OUTPUT_DIR]
+
+Samples /server-status?auto every INTERVAL seconds (default 5)
+for SECONDS (default 55), keeping the most recent `ring_size` samples
+in OUTPUT_DIR/server-status.json along with a summary of the last minute:
+
+    busy and idle workers, requests/sec, bytes/sec,
+    and how many workers are in each scoreboard state
+
+The charm runs it from cron every minute, and the nagios workers check and
+the web-server relation read the summary.
+"""
+
+import json
+import os
+import sys
+from collections import deque
+from time import sleep, time
+from urllib2 import urlopen
+
+
+server_status_url = 'http://localhost/server-status?auto'
+default_output_dir = '/var/lib/wsgi-app'
+output_name = 'server-status.json'
+
+# An hour of samples at the default interval
+ring_size = 720
+
+# How far back the summary looks
+summary_seconds = 60
+
+# What each scoreboard character means
+scoreboard_states = {
+    '_': 'waiting',
+    'S': 'starting',
+    'R': 'reading',
+    'W': 'sending',
+    'K': 'keepalive',
+    'D': 'dns_lookup',
+    'C': 'closing',
+    'L': 'logging',
+    'G': 'finishing',
+    'I': 'idle_cleanup',
+    '.': 'open_slot'
+}
+
+
+def sample():
+    """
+    Read one set of figures from mod_status
+    """
+
+    status = {}
+
+    for line in urlopen(server_status_url, timeout=5).read().splitlines():
+        if ':' in line:
+            (key, value) = line.split(':', 1)
+            status[key.strip()] = value.strip()
+
+    scoreboard = dict((name, 0) for name in scoreboard_states.values())
+
+    for character in status.get('Scoreboard', ''):
+        if character in scoreboard_states:
+            scoreboard[scoreboard_states[character]] += 1
+
+    return {
+        'time': time(),
+        'busy_workers': int(status.get('BusyWorkers', 0)),
+        'idle_workers': int(status.get('IdleWorkers', 0)),
+        'total_accesses': int(status.get('Total Accesses', 0)),
+        'total_bytes': int(status.get('Total kBytes', 0)) * 1024,
+        'scoreboard': scoreboard
+    }
+
+
+def add_rates(previous, current):
+    """
+    Work out requests and bytes per second since the previous sample,
+    unless apache has restarted and reset its counters in between
+    """
+
+    current['requests_per_second'] = None
+    current['bytes_per_second'] = None
+
+    if not previous:
+        return
+
+    elapsed = current['time'] - previous['time']
+    requests = current['total_accesses'] - previous['total_accesses']
+    sent = current['total_bytes'] - previous['total_bytes']
+
+    if elapsed > 0 and requests >= 0 and sent >= 0:
+        current['requests_per_second'] = round(requests / elapsed, 2)
+        current['bytes_per_second'] = round(sent / elapsed, 1)
+
+
+def average(values):
+    values = [value for value in values if value is not None]
+
+    if values:
+        return round(float(sum(values)) / len(values), 2)
+
+
+def summarise(samples, now):
+    recent = [
+        item for item in samples if item['time'] > now - summary_seconds
+    ]
+
+    if not recent:
+        return None
+
+    latest = recent[-1]
+    slots = sum(latest['scoreboard'].values())
+
+    return {
+        'updated': int(latest['time']),
+        'samples': len(recent),
+        'busy_workers': latest['busy_workers'],
+        'idle_workers': latest['idle_workers'],
+        'scoreboard_slots': slots,
+        'average_busy_workers': average(
+            item['busy_workers'] for item in recent
+        ),
+        'max_busy_workers': max(item['busy_workers'] for item in recent),
+        'requests_per_second': average(
+            item['requests_per_second'] for item in recent
+        ),
+        'bytes_per_second': average(
+            item['bytes_per_second'] for item in recent
+        ),
+        'scoreboard': latest['scoreboard']
+    }
+
+
+def load_samples(output_path):
+    if os.path.isfile(output_path):
+        with open(output_path) as output_file:
+            try:
+                return deque(json.load(output_file)['samples'], ring_size)
+            except (ValueError, KeyError):
+                pass
+
+    return deque([], ring_size)
+
+
+def save(output_path, samples):
+    content = json.dumps({
+        'summary': summarise(samples, time()),
+        'samples': list(samples)
+    })
+    temp_path = '{0}.tmp-{1}'.format(output_path, os.getpid())
+
+    with open(temp_path, 'w') as output_file:
+        output_file.write(content)
+
+    os.rename(temp_path, output_path)
+
+
+def collect(seconds=55, interval=5, output_dir=default_output_dir):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    output_path = os.path.join(output_dir, output_name)
+    samples = load_samples(output_path)
+    deadline = time() + seconds
+
+    while True:
+        start = time()
+
+        try:
+            current = sample()
+        except Exception as error:
+            print 'Failed to read {0}: {1}'.format(server_status_url, error)
+        else:
+            add_rates(samples[-1] if samples else None, current)
+            samples.append(current)
+            save(output_path, samples)
+
+        if start + interval > deadline:
+            break
+
+        sleep(max(0, start + interval - time()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print __doc__
+        sys.exit(0)
+
+    collect(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 55,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+        sys.argv[3] if len(sys.argv) > 3 else default_output_dir
+    )
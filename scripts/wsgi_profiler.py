@@ -0,0 +1,233 @@
+"""
+WSGI middleware which times every request, and keeps stack samples of
+slow ones as flamegraph-ready files.
+
+The charm wraps the app in this when `wsgi_profiler` is set,
+through the script rendered from templates/wsgi-wrapper.py.
+
+While any request is running, a sampler thread records the stacks of the
+threads serving requests every `interval_ms`. When a request finishes
+taking longer than `slow_ms`, its samples are written, in the folded
+format flamegraph.pl reads, into `output_dir`, which keeps only the most
+recent `keep` files. With `keep` at 0, slow requests are only noted in
+the error log. Other requests' samples are thrown away.
+
+mod_wsgi only delivers signals to the main thread, which never runs
+requests, so a thread reading sys._current_frames() stands in for
+a signal-driven sampler.
+"""
+
+import os
+import resource
+import sys
+import threading
+from itertools import count
+from time import sleep, time
+
+
+# Linux's RUSAGE_THREAD, which python 2's resource module doesn't name
+rusage_thread = getattr(resource, 'RUSAGE_THREAD', 1)
+
+profile_extension = '.folded'
+
+
+def thread_cpu_time():
+    usage = resource.getrusage(rusage_thread)
+
+    return usage.ru_utime + usage.ru_stime
+
+
+def folded_stack(frame):
+    """
+    A stack as "outermost;...;innermost", one frame per function
+    """
+
+    names = []
+
+    while frame is not None:
+        code = frame.f_code
+        names.append('{0} ({1}:{2})'.format(
+            code.co_name,
+            os.path.basename(code.co_filename),
+            code.co_firstlineno
+        ))
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+class Sampler(object):
+    """
+    One thread recording the stacks of every thread with a request
+    in progress, sleeping while there are none
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.busy = threading.Event()
+        self.thread = None
+
+    def start_request(self, thread_id):
+        samples = {}
+
+        with self.lock:
+            self.requests[thread_id] = samples
+            self.busy.set()
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+        return samples
+
+    def end_request(self, thread_id):
+        with self.lock:
+            del self.requests[thread_id]
+
+            if not self.requests:
+                self.busy.clear()
+
+    def run(self):
+        while True:
+            self.busy.wait()
+
+            frames = sys._current_frames()
+
+            with self.lock:
+                for (thread_id, samples) in self.requests.items():
+                    frame = frames.get(thread_id)
+
+                    if frame is not None:
+                        stack = folded_stack(frame)
+                        samples[stack] = samples.get(stack, 0) + 1
+
+            del frames
+
+            sleep(self.interval)
+
+
+class ClosingIterator(object):
+    """
+    Pass the response through,
+    calling `on_close` once the server has finished with it
+    """
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.on_close()
+
+
+class ProfilingMiddleware(object):
+    def __init__(
+        self, application, output_dir, slow_ms=1000, interval_ms=10,
+        keep=100
+    ):
+        self.application = application
+        self.output_dir = output_dir
+        self.slow_seconds = slow_ms / 1000.0
+        self.keep = keep
+        self.sampler = Sampler(interval_ms / 1000.0)
+        self.profile_numbers = count(1)
+
+    def __call__(self, environ, start_response):
+        thread_id = threading.current_thread().ident
+        wall_start = time()
+        cpu_start = thread_cpu_time()
+        samples = self.sampler.start_request(thread_id)
+
+        def finish():
+            wall = time() - wall_start
+            cpu = thread_cpu_time() - cpu_start
+            self.sampler.end_request(thread_id)
+
+            if wall >= self.slow_seconds:
+                self.record(environ, wall, cpu, samples)
+
+        try:
+            result = self.application(environ, start_response)
+        except Exception:
+            finish()
+            raise
+
+        # Wrapping a file_wrapper response would hide it from the server,
+        # which sends it without iterating, so stop timing here instead
+        try:
+            wrapped_file = isinstance(result, environ['wsgi.file_wrapper'])
+        except (KeyError, TypeError):
+            # No file_wrapper, or one which isn't a class
+            wrapped_file = False
+
+        if wrapped_file:
+            finish()
+            return result
+
+        return ClosingIterator(result, finish)
+
+    def record(self, environ, wall, cpu, samples):
+        """
+        Write a slow request's stack samples, and note it in the error log
+        """
+
+        profile_path = os.path.join(
+            self.output_dir,
+            '{time}-{pid}-{number}{extension}'.format(
+                time=int(time() * 1000),
+                pid=os.getpid(),
+                number=next(self.profile_numbers),
+                extension=profile_extension
+            )
+        )
+
+        description = '{method} {path}: {wall:.0f}ms wall, {cpu:.0f}ms CPU'
+        description = description.format(
+            method=environ.get('REQUEST_METHOD'),
+            path=environ.get('PATH_INFO'),
+            wall=wall * 1000,
+            cpu=cpu * 1000
+        )
+
+        if self.keep <= 0:
+            profile_path = 'not saved (keep is {0})'.format(self.keep)
+        else:
+            try:
+                with open(profile_path, 'w') as profile:
+                    for (stack, hits) in sorted(samples.items()):
+                        profile.write('{0} {1}\n'.format(stack, hits))
+
+                self.trim()
+            except (IOError, OSError) as error:
+                profile_path = 'not saved ({0})'.format(error)
+
+        environ['wsgi.errors'].write(
+            'Slow request {0}, profile {1}\n'.format(description, profile_path)
+        )
+
+    def trim(self):
+        """
+        Remove the oldest profiles beyond `keep`, or all of them if it's 0
+        """
+
+        profiles = sorted(
+            name for name in os.listdir(self.output_dir)
+            if name.endswith(profile_extension)
+        )
+
+        for name in profiles[:max(len(profiles) - self.keep, 0)]:
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+            except OSError:
+                # Another process got there first
+                pass
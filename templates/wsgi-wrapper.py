@@ -0,0 +1,38 @@
+# Managed by the apache2-wsgi charm - changes will be overwritten
+#
+# Serves {{ wsgi_path }} with the charm's environment variables
+{%- if profiler %}
+# through the charm's profiling middleware (see `wsgi_profiler` in config.yaml)
+{%- endif %}
+#
+# The charm touches this file when the environment changes,
+# which makes mod_wsgi restart its daemon processes
+
+import imp
+import json
+import os
+
+# Read the environment before the app is loaded, so it can use it at import
+try:
+    with open('{{ environment_path }}') as environment_file:
+        os.environ.update(json.load(environment_file)['variables'])
+except (IOError, ValueError, KeyError):
+    pass
+
+# Load the app script the way mod_wsgi would, under a private name
+app_module = imp.load_source('_wsgi_app_{{ timestamp }}', '{{ wsgi_path }}')
+
+application = getattr(app_module, '{{ wsgi_app_name }}')
+{%- if profiler %}
+
+# Loaded by path, so the charm's scripts never shadow the app's modules
+profiler = imp.load_source('_wsgi_app_profiler', '{{ profiler_path }}')
+
+application = profiler.ProfilingMiddleware(
+    application,
+    output_dir='{{ output_dir }}',
+    slow_ms={{ slow_ms }},
+    interval_ms={{ interval_ms }},
+    keep={{ keep }}
+)
+{%- endif %}
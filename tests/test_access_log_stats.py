@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../scripts')
+)
+
+import access_log_stats  # noqa: E402
+
+
+def log_line(request, microseconds=1500):
+    return (
+        '203.0.113.9 - - [18/Oct/2026:10:00:00 +0000] "{0}" 200 512 '
+        '"-" "curl/7.58.0" {1}'.format(request, microseconds)
+    )
+
+
+class ParseTest(unittest.TestCase):
+    def test_escaped_quotes_in_request(self):
+        (stats, unparsed) = access_log_stats.parse([
+            log_line('GET /api/search?q=\\"x\\" HTTP/1.1'),
+            log_line('GET /api/\\"quoted\\"/ HTTP/1.1')
+        ])
+
+        self.assertEqual(unparsed, 0)
+        self.assertEqual(sorted(stats), ['/api'])
+        self.assertEqual(sum(stats['/api'].buckets), 2)
+
+    def test_counts_unparsed_lines(self):
+        (stats, unparsed) = access_log_stats.parse([
+            log_line('GET /about HTTP/1.1'),
+            'not an access log line'
+        ])
+
+        self.assertEqual(unparsed, 1)
+        self.assertEqual(sorted(stats), ['/'])
+
+
+class TotalsTest(unittest.TestCase):
+    def setUp(self):
+        self.max_prefixes = access_log_stats.max_prefixes
+        access_log_stats.max_prefixes = 2
+
+    def tearDown(self):
+        access_log_stats.max_prefixes = self.max_prefixes
+
+    def requests(self, totals, prefix):
+        return sum(totals.get(prefix, {}).get('buckets', []))
+
+    def test_totals_never_decrease(self):
+        totals = {}
+        (first, unparsed) = access_log_stats.parse(
+            [log_line('GET /api/a HTTP/1.1')] * 3 +
+            [log_line('GET /static/a.js HTTP/1.1')] * 2
+        )
+        access_log_stats.add_totals(totals, first, {'/api': 3, '/static': 2})
+
+        # A scanner takes over the window
+        (second, unparsed) = access_log_stats.parse(
+            [log_line('GET /wp-admin/x HTTP/1.1')] * 10 +
+            [log_line('GET /api/a HTTP/1.1')]
+        )
+        access_log_stats.add_totals(
+            totals, second, {'/wp-admin': 10, '/api': 4, '/static': 2}
+        )
+
+        self.assertEqual(self.requests(totals, '/api'), 4)
+        self.assertEqual(self.requests(totals, '/wp-admin'), 10)
+        self.assertNotIn('/static', totals)
+        self.assertEqual(self.requests(totals, 'other'), 0)
+
+        # Requests for prefixes which aren't tracked go to "other"
+        (third, unparsed) = access_log_stats.parse(
+            [log_line('GET /static/a.js HTTP/1.1')]
+        )
+        access_log_stats.add_totals(
+            totals, third, {'/wp-admin': 10, '/api': 4, '/static': 3}
+        )
+
+        self.assertEqual(self.requests(totals, 'other'), 1)
+        self.assertEqual(self.requests(totals, '/api'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
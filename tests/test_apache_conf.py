@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+
+charm_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(charm_dir, 'hooks/lib'))
+
+from jinja2 import Environment, FileSystemLoader  # noqa: E402
+
+
+def render(**settings):
+    jinja_env = Environment(loader=FileSystemLoader(charm_dir))
+    template = jinja_env.get_template('templates/wsgi-app.conf')
+    context = {
+        'wsgi_path': '/srv/wsgi-app-live/wsgi.py',
+        'wsgi_app_name': 'application',
+        'wsgi_dir': '/srv/wsgi-app-live',
+        'wsgi_file': 'wsgi.py',
+        'wsgi_daemon': None,
+        'https_direct': False,
+        'static_url_path': 'static',
+        'static_path': '/srv/wsgi-app-live/static',
+        'static_max_age': 0,
+        'keyfile_path': '/etc/ssl/private/wsgi-app.key',
+        'certificate_path': '/etc/ssl/certs/wsgi-app.crt'
+    }
+    context.update(settings)
+
+    return template.render(context)
+
+
+def virtual_hosts(conf):
+    """
+    The lines of each <VirtualHost> block, by address
+    """
+
+    hosts = {}
+
+    for block in conf.split('<VirtualHost ')[1:]:
+        (address, body) = block.split('>', 1)
+        body = body.split('</VirtualHost>')[0]
+        hosts[address] = [line.strip() for line in body.split('\n')]
+
+    return hosts
+
+
+class ServerStatusTest(unittest.TestCase):
+    def test_not_proxied_from_https(self):
+        https_lines = virtual_hosts(render())['*:443']
+
+        self.assertIn('ProxyPass /server-status !', https_lines)
+        self.assertLess(
+            https_lines.index('ProxyPass /server-status !'),
+            https_lines.index('ProxyPass / http://localhost/')
+        )
+
+    def test_not_served_over_direct_https(self):
+        https_lines = virtual_hosts(render(https_direct=True))['*:443']
+
+        self.assertFalse(
+            [line for line in https_lines if 'server-status' in line]
+        )
+
+    def test_polls_not_logged(self):
+        http_lines = virtual_hosts(render())['*:80']
+
+        self.assertIn(
+            'SetEnvIf Request_URI ^/server-status dontlog', http_lines
+        )
+        self.assertIn(
+            'CustomLog /var/log/apache2/wsgi-app-access.log '
+            'combined_with_request_time env=!dontlog',
+            http_lines
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
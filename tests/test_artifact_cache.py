@@ -0,0 +1,78 @@
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../hooks/lib')
+)
+
+import artifact_cache  # noqa: E402
+
+
+artifact_cache.log = lambda message, level=None: None
+
+
+class TruncatingServer(object):
+    """
+    Answer every request with a Content-Length of `length`
+    but only `sent` bytes of body, then hang up
+    """
+
+    def __init__(self, length, sent):
+        self.length = length
+        self.sent = sent
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.url = 'http://127.0.0.1:{0}/app.tgz'.format(
+            self.listener.getsockname()[1]
+        )
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            (connection, address) = self.listener.accept()
+            connection.recv(65536)
+            connection.sendall(
+                'HTTP/1.0 200 OK\r\n'
+                'Content-Length: {0}\r\n'
+                'ETag: "v1"\r\n\r\n'.format(self.length)
+            )
+            connection.sendall('x' * self.sent)
+            connection.close()
+
+
+class CachingReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = artifact_cache.ArtifactCache(self.cache_dir, 1 << 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_truncated_download_is_not_cached(self):
+        server = TruncatingServer(2500000, 1250000)
+
+        with self.assertRaises(IOError):
+            self.cache.fetch(server.url)
+
+        self.assertEqual(self.cache.index['urls'], {})
+        self.assertEqual(os.listdir(self.cache.blobs_dir), [])
+
+    def test_complete_download_is_cached(self):
+        server = TruncatingServer(1000, 1000)
+
+        cached_path = self.cache.fetch(server.url)
+
+        self.assertEqual(os.path.getsize(cached_path), 1000)
+        self.assertEqual(self.cache.index['urls'][server.url]['etag'], '"v1"')
+
+
+if __name__ == '__main__':
+    unittest.main()
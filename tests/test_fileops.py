@@ -0,0 +1,67 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../hooks/lib')
+)
+
+import fileops  # noqa: E402
+import hook_timings  # noqa: E402
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.site_path = os.path.join(self.work_dir, 'site.conf')
+        self.new_path = os.path.join(self.work_dir, 'new.key')
+        self.enabled_dir = os.path.join(self.work_dir, 'mods-enabled')
+
+        with open(self.site_path, 'w') as site:
+            site.write('working')
+
+        os.chmod(self.site_path, 0640)
+        os.mkdir(self.enabled_dir)
+        os.symlink('../ssl.load', os.path.join(self.enabled_dir, 'ssl.load'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+        # Keep the timing report, which logs through juju-log, quiet
+        hook_timings.timings.clear()
+
+    def test_restores_files_and_directory_entries(self):
+        snapshot = fileops.snapshot_paths(
+            [self.site_path, self.new_path], [self.enabled_dir]
+        )
+
+        with open(self.site_path, 'w') as site:
+            site.write('broken')
+
+        with open(self.new_path, 'w') as key:
+            key.write('key')
+
+        os.remove(os.path.join(self.enabled_dir, 'ssl.load'))
+        os.symlink(
+            '../mpm_prefork.load',
+            os.path.join(self.enabled_dir, 'mpm_prefork.load')
+        )
+
+        fileops.restore_paths(snapshot)
+
+        with open(self.site_path) as site:
+            self.assertEqual(site.read(), 'working')
+
+        self.assertEqual(os.stat(self.site_path).st_mode & 0777, 0640)
+        self.assertFalse(os.path.exists(self.new_path))
+        self.assertEqual(os.listdir(self.enabled_dir), ['ssl.load'])
+        self.assertEqual(
+            os.readlink(os.path.join(self.enabled_dir, 'ssl.load')),
+            '../ssl.load'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
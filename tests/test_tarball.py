@@ -0,0 +1,197 @@
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../hooks/lib')
+)
+
+import tarball  # noqa: E402
+
+
+tarball.log = lambda message, level=None: None
+
+
+def build_tgz(tgz_path, members):
+    """
+    Write a gzipped tarball from (name, type, content_or_linkname) tuples
+    """
+
+    archive = tarfile.open(tgz_path, 'w:gz')
+
+    for (name, member_type, value) in members:
+        info = tarfile.TarInfo(name)
+        info.mode = 0644
+
+        if member_type == 'file':
+            info.size = len(value)
+            archive.addfile(info, StringIO(value))
+        elif member_type == 'dir':
+            info.type = tarfile.DIRTYPE
+            info.mode = 0755
+            archive.addfile(info)
+        elif member_type == 'symlink':
+            info.type = tarfile.SYMTYPE
+            info.linkname = value
+            archive.addfile(info)
+        elif member_type == 'hardlink':
+            info.type = tarfile.LNKTYPE
+            info.linkname = value
+            archive.addfile(info)
+
+    archive.close()
+
+
+class ExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.install_path = os.path.join(self.work_dir, 'release')
+        self.victim_dir = os.path.join(self.work_dir, 'victim')
+        self.tgz_path = os.path.join(self.work_dir, 'app.tgz')
+
+        os.mkdir(self.install_path)
+        os.mkdir(self.victim_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def extract(self, members, previous_path=None):
+        build_tgz(self.tgz_path, members)
+
+        return tarball.extract_file(
+            self.tgz_path, self.install_path, 1, previous_path
+        )
+
+    def test_extracts_files(self):
+        self.extract([
+            ('app', 'dir', None),
+            ('app/static', 'dir', None),
+            ('app/static/app.js', 'file', 'alert(1);'),
+            ('app/link.js', 'symlink', 'static/app.js')
+        ])
+
+        with open(os.path.join(self.install_path, 'link.js')) as linked:
+            self.assertEqual(linked.read(), 'alert(1);')
+
+    def test_refuses_to_write_through_a_symlink(self):
+        with self.assertRaises(tarball.UnsafeMemberError):
+            self.extract([
+                ('app', 'dir', None),
+                ('app/link', 'symlink', self.victim_dir),
+                ('app/link/x', 'file', 'owned')
+            ])
+
+        self.assertEqual(os.listdir(self.victim_dir), [])
+
+    def test_refuses_relative_symlinks_out_of_the_tree(self):
+        with self.assertRaises(tarball.UnsafeMemberError):
+            self.extract([
+                ('app', 'dir', None),
+                ('app/link', 'symlink', '../victim')
+            ])
+
+    def test_refuses_to_replace_a_symlink(self):
+        with self.assertRaises(tarball.UnsafeMemberError):
+            self.extract([
+                ('app', 'dir', None),
+                ('app/data', 'file', 'one'),
+                ('app/link', 'symlink', 'data'),
+                ('app/link', 'file', 'two')
+            ])
+
+        with open(os.path.join(self.install_path, 'data')) as data:
+            self.assertEqual(data.read(), 'one')
+
+    def test_skips_absolute_hardlinks(self):
+        victim_file = os.path.join(self.victim_dir, 'secret')
+
+        with open(victim_file, 'w') as secret:
+            secret.write('secret')
+
+        self.extract([
+            ('app', 'dir', None),
+            ('app/secret', 'hardlink', victim_file)
+        ])
+
+        self.assertFalse(
+            os.path.lexists(os.path.join(self.install_path, 'secret'))
+        )
+
+
+class ExtractWithPreviousTest(ExtractTest):
+    """
+    The same cases, hardlinking unchanged files from a previous release
+    """
+
+    def setUp(self):
+        super(ExtractWithPreviousTest, self).setUp()
+
+        self.previous_path = os.path.join(self.work_dir, 'previous')
+        os.mkdir(self.previous_path)
+
+    def extract(self, members, previous_path=None):
+        return super(ExtractWithPreviousTest, self).extract(
+            members, previous_path or self.previous_path
+        )
+
+    def test_links_unchanged_files(self):
+        with open(os.path.join(self.previous_path, 'app.js'), 'w') as old:
+            old.write('alert(1);')
+
+        os.chmod(os.path.join(self.previous_path, 'app.js'), 0644)
+
+        (written, reused) = self.extract([
+            ('app', 'dir', None),
+            ('app/app.js', 'file', 'alert(1);')
+        ])
+
+        self.assertEqual(reused, len('alert(1);'))
+        self.assertEqual(
+            os.stat(os.path.join(self.install_path, 'app.js')).st_ino,
+            os.stat(os.path.join(self.previous_path, 'app.js')).st_ino
+        )
+
+    def test_does_not_link_through_a_previous_symlink(self):
+        victim_file = os.path.join(self.victim_dir, 'x')
+
+        with open(victim_file, 'w') as victim:
+            victim.write('owned')
+
+        os.chmod(victim_file, 0644)
+        os.symlink(self.victim_dir, os.path.join(self.previous_path, 'link'))
+
+        self.extract([
+            ('app', 'dir', None),
+            ('app/link', 'dir', None),
+            ('app/link/x', 'file', 'owned')
+        ])
+
+        self.assertNotEqual(
+            os.stat(os.path.join(self.install_path, 'link/x')).st_ino,
+            os.stat(victim_file).st_ino
+        )
+
+    def test_refuses_to_write_through_a_previous_symlink(self):
+        with open(os.path.join(self.victim_dir, 'x'), 'w') as victim:
+            victim.write('owned')
+
+        os.chmod(os.path.join(self.victim_dir, 'x'), 0644)
+        os.symlink(self.victim_dir, os.path.join(self.previous_path, 'link'))
+
+        with self.assertRaises(tarball.UnsafeMemberError):
+            self.extract([
+                ('app', 'dir', None),
+                ('app/link', 'symlink', self.victim_dir),
+                ('app/link/x', 'file', 'other')
+            ])
+
+        with open(os.path.join(self.victim_dir, 'x')) as victim:
+            self.assertEqual(victim.read(), 'owned')
+
+
+if __name__ == '__main__':
+    unittest.main()
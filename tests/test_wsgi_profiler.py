@@ -0,0 +1,88 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from wsgiref.util import FileWrapper
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../scripts')
+)
+
+import wsgi_profiler  # noqa: E402
+
+
+def slow_app(environ, start_response):
+    start_response('200 OK', [])
+    return ['done']
+
+
+def file_app(environ, start_response):
+    start_response('200 OK', [])
+    return environ['wsgi.file_wrapper'](StringIO('contents'))
+
+
+class ProfilingMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.errors = StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def call(self, middleware):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/',
+            'wsgi.errors': self.errors,
+            'wsgi.file_wrapper': FileWrapper
+        }
+        result = middleware(environ, lambda status, headers: None)
+        body = ''.join(result)
+
+        if hasattr(result, 'close'):
+            result.close()
+
+        return (result, body)
+
+    def profiles(self):
+        return os.listdir(self.output_dir)
+
+    def test_keeps_most_recent(self):
+        middleware = wsgi_profiler.ProfilingMiddleware(
+            slow_app, self.output_dir, slow_ms=0, keep=2
+        )
+
+        for attempt in range(4):
+            self.call(middleware)
+
+        self.assertEqual(len(self.profiles()), 2)
+
+    def test_keep_none(self):
+        open(os.path.join(self.output_dir, '1-1-1.folded'), 'w').close()
+        middleware = wsgi_profiler.ProfilingMiddleware(
+            slow_app, self.output_dir, slow_ms=0, keep=0
+        )
+
+        self.call(middleware)
+        middleware.trim()
+
+        self.assertEqual(self.profiles(), [])
+        self.assertIn('not saved', self.errors.getvalue())
+
+    def test_file_wrapper_passed_through(self):
+        middleware = wsgi_profiler.ProfilingMiddleware(
+            file_app, self.output_dir, slow_ms=0
+        )
+
+        (result, body) = self.call(middleware)
+
+        self.assertIsInstance(result, FileWrapper)
+        self.assertEqual(body, 'contents')
+        self.assertEqual(middleware.sampler.requests, {})
+        self.assertEqual(len(self.profiles()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()